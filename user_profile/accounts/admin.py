@@ -2,9 +2,19 @@ from django import forms
 from django.contrib import admin
 from django.contrib.auth.models import Group
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.contrib.admin.views.main import (
+    ALL_VAR, ChangeList, ORDER_VAR, PAGE_VAR
+)
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
+from django.utils.functional import cached_property
 
+from . import exports
 from . import models
+from . import search
+from .pagination import CachedCountPaginator
+
+# Query string parameter holding the last email of the previous page
+SEEK_VAR = 'after'
 
 
 class UserCreationForm(forms.ModelForm):
@@ -61,6 +71,50 @@ class UserProfileInline(admin.StackedInline):
     fk_name = 'user'
 
 
+class EmailSeekChangeList(ChangeList):
+    """Change list that pages forward with `?after=<email>`.
+
+    With the default ordering by email, the next page is read with
+    `email > after` from the unique email index instead of an ever-growing
+    OFFSET, so deep pages cost the same as the first one.
+    """
+    def __init__(self, request, *args, **kwargs):
+        self.seek_after = None
+        if ORDER_VAR not in request.GET and ALL_VAR not in request.GET:
+            self.seek_after = request.GET.get(SEEK_VAR)
+        super(EmailSeekChangeList, self).__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super(EmailSeekChangeList, self).get_filters_params(
+            params)
+        lookup_params.pop(SEEK_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Changing filters or ordering starts again from the first page
+        remove = list(remove or [])
+        if not new_params or SEEK_VAR not in new_params:
+            remove.append(SEEK_VAR)
+        return super(EmailSeekChangeList, self).get_query_string(
+            new_params, remove)
+
+    def get_results(self, request):
+        super(EmailSeekChangeList, self).get_results(request)
+        if self.seek_after is not None:
+            self.result_list = self.queryset.filter(
+                email__gt=self.seek_after)[:self.list_per_page]
+
+    @cached_property
+    def next_page_url(self):
+        if ORDER_VAR in self.params or (self.show_all and self.can_show_all):
+            return None
+        results = list(self.result_list)
+        if len(results) < self.list_per_page:
+            return None
+        return self.get_query_string({SEEK_VAR: results[-1].email},
+            [PAGE_VAR])
+
+
 class UserAdmin(BaseUserAdmin):
     # The form to add and change user instances
     form = UserChangeForm
@@ -86,22 +140,56 @@ class UserAdmin(BaseUserAdmin):
             'fields': ('email', 'password1' , 'password2')}
         ),
     )
+    # Searches go through the token index in get_search_results(); the
+    # fields only turn the admin search box on.
     search_fields = ('email', 'first_name', 'last_name',)
     ordering = ('email',)
     filter_horizontal = ()
     inlines = (UserProfileInline,)
+    actions = ('export_as_csv', 'export_as_jsonl')
+
+    # Counts are cached and the unfiltered total is never computed; pages
+    # past the first are reached with EmailSeekChangeList's "after" links.
+    paginator = CachedCountPaginator
+    show_full_result_count = False
 
     def get_dob(self, instance):
         return instance.userprofile.dob
     get_dob.short_description = 'Birth Date'
 
+    def export_as_csv(self, request, queryset):
+        return exports.export_response(queryset, 'csv')
+    export_as_csv.short_description = 'Export selected users as CSV'
+
+    def export_as_jsonl(self, request, queryset):
+        return exports.export_response(queryset, 'jsonl')
+    export_as_jsonl.short_description = 'Export selected users as JSONL'
+
+    def get_changelist(self, request, **kwargs):
+        return EmailSeekChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search.search_users(queryset, search_term), False
+
     def get_inline_instances(self, request, obj=None):
         if not obj:
             return list()
         return super(UserAdmin, self).get_inline_instances(request, obj)
 
+class JobAdmin(admin.ModelAdmin):
+    """Read-mostly view of the background job queue."""
+    list_display = ('name', 'status', 'priority', 'attempts', 'run_at',
+        'duration')
+    list_filter = ('status', 'name')
+    readonly_fields = ('name', 'payload', 'attempts', 'locked_by',
+        'created_at', 'started_at', 'finished_at', 'duration', 'last_error')
+    ordering = ('-created_at',)
+
 # Now register the new UserAdmin
 admin.site.register(models.User, UserAdmin)
+admin.site.register(models.Job, JobAdmin)
 # ... and, since we're not using Django's built-in permissions,
 # unregister the Group model from admin.
 admin.site.unregister(Group)
@@ -0,0 +1,175 @@
+"""Build step bundling the site's stylesheets and scripts.
+
+Each bundle in ASSET_BUNDLES lists source files under the static assets
+directory. Sources are deduplicated, concatenated and minified into one file
+per bundle, named after a hash of its content. A .gz copy is written next to
+it (and a .br copy when the brotli package is installed). manifest.json then
+maps each bundle's logical name to its hashed file, for
+BundleStaticFilesStorage to resolve in the {% static %} tag.
+"""
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CSS_TOKENS = re.compile(
+    r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|(/\*.*?\*/)', re.S)
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def dedupe(sources, source_dir):
+    """Drop repeated sources, treating x.css and x.min.css as the same file.
+
+    The last occurrence of a file keeps its place, because that is the copy
+    whose rules win in the cascade, and the .min variant is used when it
+    exists.
+    """
+    def key(name):
+        return name.replace('.min.', '.')
+
+    keys = [key(name) for name in sources]
+    kept = [name for i, name in enumerate(sources)
+            if key(name) not in keys[i + 1:]]
+    result = []
+    for name in kept:
+        root, ext = posixpath.splitext(key(name))
+        minified = root + '.min' + ext
+        if os.path.exists(os.path.join(source_dir, minified)):
+            name = minified
+        result.append(name)
+    return result
+
+
+def minify_css(css):
+    """Strip comments and redundant whitespace, leaving strings intact."""
+    parts = []
+    last = 0
+    for match in CSS_TOKENS.finditer(css):
+        parts.append(_squeeze_css(css[last:match.start()]))
+        if match.group(1):
+            parts.append(match.group(1))
+        last = match.end()
+    parts.append(_squeeze_css(css[last:]))
+    return ''.join(parts).strip()
+
+
+def _squeeze_css(text):
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ?([{};,>]) ?', r'\1', text)
+    return text.replace(';}', '}')
+
+
+def rebase_urls(css, source_name, bundle_name):
+    """Rewrite relative url()s in a stylesheet for the bundle's location."""
+    source_dir = posixpath.dirname(source_name)
+    bundle_dir = posixpath.dirname(bundle_name)
+
+    def rebase(match):
+        quote, url = match.groups()
+        if re.match(r'^([a-z]+:|/|#)', url):
+            return match.group(0)
+        target = posixpath.normpath(posixpath.join(source_dir, url))
+        return 'url({0}{1}{0})'.format(
+            quote, posixpath.relpath(target, bundle_dir or '.'))
+    return CSS_URL.sub(rebase, css)
+
+
+def build_bundle(bundle_name, sources, source_dir):
+    """Return the minified content of one bundle."""
+    chunks = []
+    for name in dedupe(sources, source_dir):
+        with open(os.path.join(source_dir, name), encoding='utf-8') as f:
+            content = f.read()
+        if bundle_name.endswith('.css'):
+            chunks.append(minify_css(rebase_urls(content, name, bundle_name)))
+        else:
+            # Scripts are not rewritten; .min sources are picked by dedupe().
+            # The separator stops one file's last statement running into
+            # the next file.
+            chunks.append(content.strip().rstrip(';') + ';')
+    return '\n'.join(chunks) + '\n'
+
+
+def hashed_name(name, content):
+    root, ext = posixpath.splitext(name)
+    digest = hashlib.md5(content).hexdigest()[:12]
+    return '{}.{}{}'.format(root, digest, ext)
+
+
+def write_compressed(path, content):
+    """Write precompressed siblings of a file; returns their paths."""
+    written = [path + '.gz']
+    with open(path + '.gz', 'wb') as f:
+        # A fixed mtime keeps rebuilds of unchanged content byte-identical
+        with gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0,
+                           compresslevel=9) as gz:
+            gz.write(content)
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(content))
+        written.append(path + '.br')
+    return written
+
+
+def build_assets(bundles=None, source_dir=None):
+    """Build every bundle and write the manifest.
+
+    Returns the manifest, a dict of logical name to hashed name. Bundle
+    names are relative to the static source directory, e.g.
+    'bundles/site.css'.
+    """
+    bundles = bundles if bundles is not None else settings.ASSET_BUNDLES
+    source_dir = source_dir or settings.ASSET_SOURCE_DIR
+    manifest = {}
+    for bundle_name, sources in sorted(bundles.items()):
+        content = build_bundle(bundle_name, sources, source_dir).encode(
+            'utf-8')
+        target_name = hashed_name(bundle_name, content)
+        target = os.path.join(source_dir, target_name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _remove_old_builds(bundle_name, target_name, source_dir)
+        with open(target, 'wb') as f:
+            f.write(content)
+        write_compressed(target, content)
+        manifest[bundle_name] = target_name
+
+    with open(get_manifest_path(source_dir), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return manifest
+
+
+def get_manifest_path(source_dir=None):
+    return os.path.join(source_dir or settings.ASSET_SOURCE_DIR,
+        settings.ASSET_MANIFEST)
+
+
+def load_manifest(source_dir=None):
+    """Return the bundle manifest, or an empty one if it was never built."""
+    try:
+        with open(get_manifest_path(source_dir)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _remove_old_builds(bundle_name, keep, source_dir):
+    directory = os.path.join(source_dir, posixpath.dirname(bundle_name))
+    if not os.path.isdir(directory):
+        return
+    root, ext = posixpath.splitext(posixpath.basename(bundle_name))
+    old_build = re.compile(r'^{}\.[0-9a-f]{{12}}{}(\.gz|\.br)?$'.format(
+        re.escape(root), re.escape(ext)))
+    for filename in os.listdir(directory):
+        if old_build.match(filename) and \
+                not filename.startswith(posixpath.basename(keep)):
+            os.remove(os.path.join(directory, filename))
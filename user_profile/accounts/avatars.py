@@ -0,0 +1,149 @@
+"""Fixed-size avatar variants, generated off the request path.
+
+Uploaded avatars are stored as-is. After a profile is saved with a new
+avatar, a queued task (see accounts.tasks) writes square JPEG (and, when
+Pillow supports it, WebP) copies of it in each of AVATAR_SIZES, with the
+EXIF orientation applied and all metadata stripped. Templates use
+AvatarVariants to build `srcset` attributes and fall back to the original
+until the variants exist.
+"""
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from PIL import Image, ImageOps
+
+from . import caching
+from . import tasks
+
+AVATAR_SIZES = (64, 128, 256)
+VARIANTS_DIR = 'variants'
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+# EXIF orientation tag values and the transpositions that undo them
+EXIF_ORIENTATION = 0x0112
+ORIENTATION_TRANSPOSES = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_90),
+    6: (Image.ROTATE_270,),
+    7: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_270),
+    8: (Image.ROTATE_90,),
+}
+
+def variant_formats():
+    """Return the output formats this Pillow build can write."""
+    Image.init()
+    return [fmt for fmt in ('JPEG', 'WEBP') if fmt in Image.SAVE]
+
+
+def variant_name(name, size, fmt):
+    """Return the storage name of one variant of the avatar `name`."""
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, VARIANTS_DIR, '{}_{}.{}'.format(
+        stem, size, EXTENSIONS[fmt]))
+
+
+def apply_orientation(image):
+    """Return the image rotated and flipped as its EXIF orientation says."""
+    try:
+        orientation = image._getexif()[EXIF_ORIENTATION]
+    except (AttributeError, KeyError, IndexError, TypeError):
+        return image
+    for method in ORIENTATION_TRANSPOSES.get(orientation, ()):
+        image = image.transpose(method)
+    return image
+
+
+def generate_variants(name, storage=default_storage):
+    """Write every size and format variant of the avatar stored as `name`."""
+    with storage.open(name) as f:
+        image = Image.open(f)
+        image.load()
+        image = apply_orientation(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+    # The largest JPEG is written last; AvatarVariants.ready checks for it.
+    formats = sorted(variant_formats(), key=lambda fmt: fmt == 'JPEG')
+    for size in AVATAR_SIZES:
+        # A copy of the pixel data only, so no EXIF or other metadata from
+        # the upload is carried over.
+        variant = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        for fmt in formats:
+            buf = BytesIO()
+            if fmt == 'JPEG':
+                variant.save(buf, fmt, quality=85, optimize=True,
+                    progressive=True)
+            else:
+                variant.save(buf, fmt, quality=80)
+            target = variant_name(name, size, fmt)
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(buf.getvalue()))
+
+
+def schedule_variants(profile):
+    """Queue variant generation for a profile's avatar."""
+    generate_avatar_variants.delay(name=profile.avatar.name,
+        user_id=profile.user_id)
+
+
+# Ahead of other jobs: the profile page shows the full-size upload until
+# the variants exist.
+@tasks.task(priority=10, retry_delay=10)
+def generate_avatar_variants(name, user_id):
+    from .models import UserProfile
+
+    generate_variants(name)
+    # Profile pages change once the variants exist, so bump the profile's
+    # last_modified time, which keys every cached copy of it.
+    UserProfile.objects.filter(user_id=user_id).update(
+        updated_at=timezone.now())
+    caching.invalidate_user(user_id)
+
+
+class AvatarVariants(object):
+    """Template accessor for the variants of an avatar."""
+
+    def __init__(self, image_file):
+        self.file = image_file
+
+    @cached_property
+    def ready(self):
+        return self.file.storage.exists(
+            variant_name(self.file.name, AVATAR_SIZES[-1], 'JPEG'))
+
+    def url(self, size, fmt='JPEG'):
+        return self.file.storage.url(variant_name(self.file.name, size, fmt))
+
+    def srcset(self, fmt='JPEG'):
+        return ', '.join('{} {}w'.format(self.url(size, fmt), size)
+            for size in AVATAR_SIZES)
+
+    @property
+    def src(self):
+        if not self.ready:
+            return self.file.url
+        return self.url(AVATAR_SIZES[1])
+
+    @property
+    def jpeg_srcset(self):
+        return self.srcset('JPEG') if self.ready else ''
+
+    @property
+    def webp_srcset(self):
+        if self.ready and 'WEBP' in variant_formats():
+            return self.srcset('WEBP')
+        return ''
@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from . import caching
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend that caches each user, with its profile, by id.
+
+    AuthenticationMiddleware loads request.user through get_user(), so a
+    warm cache serves both the user and user.userprofile without a query.
+    Entries are dropped whenever a user or profile is saved, from the cache
+    behind USER_CACHE_ALIAS, which every process must share.
+    """
+    def get_user(self, user_id):
+        user = caching.get_cached_user(user_id)
+        if user is None:
+            UserModel = get_user_model()
+            try:
+                user = UserModel._default_manager.select_related(
+                    'userprofile').get(pk=user_id)
+            except UserModel.DoesNotExist:
+                return None
+            caching.cache_user(user)
+        return user if self.user_can_authenticate(user) else None
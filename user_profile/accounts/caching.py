@@ -0,0 +1,123 @@
+"""Per-user caches of authenticated users and rendered profile pages.
+
+Users are cached together with their profile by id, for the authentication
+backend, in a cache shared by every process so that saving a user takes
+effect everywhere at once. Profile fragments are keyed by user id and
+the profile's last_modified time, so a saved profile is rendered afresh
+by every process and stale fragments simply age out of the cache.
+
+deploy_version() identifies the templates and asset bundles being served,
+for validators of pages built from them.
+"""
+import functools
+import hashlib
+import os
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from . import assets
+
+USER_KEY = 'accounts:user:{}'
+PROFILE_FRAGMENT_KEY = 'accounts:profile:fragment:{}:{:.6f}'
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'PROFILE_CACHE_ALIAS', 'default')]
+
+
+def get_user_cache():
+    return caches[getattr(settings, 'USER_CACHE_ALIAS', 'default')]
+
+
+def relocated_caches(directory):
+    """Return settings.CACHES with every file-based cache moved below
+    `directory`, so tests and benchmarks leave the real ones alone."""
+    relocated = {}
+    for alias, config in settings.CACHES.items():
+        if config['BACKEND'].endswith('.FileBasedCache'):
+            config = dict(config, LOCATION=os.path.join(directory, alias))
+        relocated[alias] = config
+    return relocated
+
+
+def get_cached_user(user_id):
+    """Return the cached user (with its profile) for an id, or None."""
+    return get_user_cache().get(USER_KEY.format(user_id))
+
+
+def cache_user(user):
+    get_user_cache().set(USER_KEY.format(user.pk), user,
+        getattr(settings, 'USER_CACHE_TIMEOUT', 300))
+
+
+def invalidate_user(user_id):
+    get_user_cache().delete(USER_KEY.format(user_id))
+
+
+def render_profile(user):
+    """Return the rendered profile fragment for a user, from the cache when
+    possible."""
+    cache = get_cache()
+    key = PROFILE_FRAGMENT_KEY.format(user.pk,
+        user.userprofile.last_modified.timestamp())
+    html = cache.get(key)
+    if html is None:
+        _record('misses')
+        html = render_to_string('accounts/profile_detail.html',
+            {'user': user})
+        cache.set(key, html, getattr(settings, 'PROFILE_CACHE_TIMEOUT', 300))
+    else:
+        _record('hits')
+    return mark_safe(html)
+
+
+@functools.lru_cache()
+def deploy_version():
+    """Return a digest of the project's templates and the asset manifest,
+    and when they last changed.
+
+    Read once per process, like the templates themselves when the cached
+    loader is on.
+    """
+    paths = [assets.get_manifest_path()]
+    for config in settings.TEMPLATES:
+        for directory in config.get('DIRS', []):
+            for root, dirs, files in os.walk(directory):
+                paths.extend(os.path.join(root, name) for name in files)
+    digest = hashlib.md5()
+    changed = 0
+    for path in sorted(paths):
+        try:
+            with open(path, 'rb') as f:
+                digest.update(path.encode('utf-8') + b'\0' + f.read())
+            changed = max(changed, os.path.getmtime(path))
+        except OSError:
+            continue
+    return digest.hexdigest()[:12], datetime.fromtimestamp(int(changed),
+        timezone.utc)
+
+
+def profile_cache_stats():
+    """Return the hit and miss counters of this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_profile_cache_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def _record(name):
+    with _stats_lock:
+        _stats[name] += 1
@@ -0,0 +1,82 @@
+"""Keyset-paginated listing of public profiles.
+
+Pages are ordered by (date_joined, user id) and continue from an opaque
+cursor holding the last row of the previous page, so every page is one
+indexed range read however deep it is.
+"""
+import base64
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import UserProfile
+
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+# The only columns a directory page reads
+DIRECTORY_FIELDS = (
+    'bio', 'location', 'country', 'avatar', 'updated_at', 'user__username',
+    'user__first_name', 'user__last_name', 'user__date_joined',
+    'user__updated_at',
+)
+
+
+def encode_cursor(profile):
+    value = '{}|{}'.format(profile.user.date_joined.isoformat(),
+        profile.user_id)
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return (date_joined, user_id) from a cursor, or raise ValueError."""
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        date_joined, user_id = value.decode('utf-8').split('|')
+        date_joined, user_id = parse_datetime(date_joined), int(user_id)
+    except (TypeError, UnicodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if date_joined is None:
+        raise ValueError("Invalid cursor")
+    return date_joined, user_id
+
+
+def get_page(country=None, location=None, cursor=None, size=PAGE_SIZE):
+    """Return (profiles, next_cursor) for one directory page.
+
+    `next_cursor` is None on the last page. Raises ValueError for an
+    invalid cursor.
+    """
+    profiles = UserProfile.objects.select_related('user').only(
+        *DIRECTORY_FIELDS).filter(user__is_active=True)
+    if country:
+        profiles = profiles.filter(country=country.upper())
+    if location:
+        profiles = profiles.filter(location=location)
+    if cursor:
+        date_joined, user_id = decode_cursor(cursor)
+        profiles = profiles.filter(
+            Q(user__date_joined__gt=date_joined) |
+            Q(user__date_joined=date_joined, user_id__gt=user_id)
+        )
+    # One extra row tells whether there is a next page
+    page = list(profiles.order_by('user__date_joined', 'user_id')[:size + 1])
+    if len(page) > size:
+        return page[:size], encode_cursor(page[size - 1])
+    return page, None
+
+
+def profile_data(profile):
+    """Return the public fields of a profile as a JSON-ready dict."""
+    user = profile.user
+    variants = profile.avatar_variants
+    return {
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'date_joined': user.date_joined,
+        'bio': profile.bio,
+        'location': profile.location,
+        'country': profile.country.code or None,
+        'avatar': variants.src if variants else None,
+    }
@@ -0,0 +1,92 @@
+"""Streaming export of users joined with their profiles.
+
+Rows are read in primary key order, `chunk_size` at a time, so memory use
+stays flat however many users are exported. (The SQLite backend cannot
+stream a single cursor, so QuerySet.iterator() alone would still load the
+whole result.)
+"""
+import csv
+import json
+from collections import OrderedDict
+from datetime import date
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+# (column name, lookup) pairs, in export order
+EXPORT_FIELDS = (
+    ('id', 'pk'),
+    ('email', 'email'),
+    ('first_name', 'first_name'),
+    ('last_name', 'last_name'),
+    ('username', 'username'),
+    ('date_joined', 'date_joined'),
+    ('is_active', 'is_active'),
+    ('dob', 'userprofile__dob'),
+    ('bio', 'userprofile__bio'),
+    ('location', 'userprofile__location'),
+    ('country', 'userprofile__country'),
+    ('fav_animal', 'userprofile__fav_animal'),
+    ('hobby', 'userprofile__hobby'),
+)
+COLUMNS = [name for name, lookup in EXPORT_FIELDS]
+
+
+def iter_user_rows(queryset, chunk_size=1000):
+    """Yield an OrderedDict per user in `queryset`."""
+    queryset = queryset.order_by('pk').values_list(
+        *[lookup for name, lookup in EXPORT_FIELDS])
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else \
+            queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+        for row in chunk:
+            yield OrderedDict(zip(COLUMNS, row))
+        last_pk = chunk[-1][0]
+
+
+class Echo(object):
+    """File-like object returning what is written to it, for csv.writer."""
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow([
+            value.isoformat() if isinstance(value, date) else value
+            for value in row.values()
+        ])
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+FORMATS = {
+    'csv': (iter_csv, 'text/csv'),
+    'jsonl': (iter_jsonl, 'application/x-ndjson'),
+}
+
+
+def export_users(queryset, file_format, chunk_size=1000):
+    """Return an iterator of CSV or JSONL lines for the users in
+    `queryset`."""
+    serializer = FORMATS[file_format][0]
+    return serializer(iter_user_rows(queryset, chunk_size))
+
+
+def export_response(queryset, file_format, filename='users'):
+    """Return a StreamingHttpResponse downloading the users in
+    `queryset`."""
+    response = StreamingHttpResponse(export_users(queryset, file_format),
+        content_type=FORMATS[file_format][1])
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+        filename, file_format)
+    return response
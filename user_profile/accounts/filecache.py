@@ -0,0 +1,37 @@
+"""A file-based cache whose add() is atomic across processes.
+
+Django's FileBasedCache.add() checks for the key and then sets it, so two
+processes can both succeed. Here the new file is hard-linked into place,
+which fails if another process got there first; the bucket locks in
+throttling rely on that.
+"""
+import io
+import os
+import pickle
+import tempfile
+import zlib
+
+from django.core.cache.backends import filebased
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+
+class FileBasedCache(filebased.FileBasedCache):
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Drops the file of an expired entry, so it can be replaced
+        if self.has_key(key, version):
+            return False
+        self._createdir()
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+        try:
+            with io.open(fd, 'wb') as f:
+                f.write(pickle.dumps(self.get_backend_timeout(timeout),
+                    pickle.HIGHEST_PROTOCOL))
+                f.write(zlib.compress(
+                    pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            os.link(tmp_path, self._key_to_file(key, version))
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+        return True
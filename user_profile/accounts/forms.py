@@ -9,11 +9,11 @@ from django_password_strength.widgets import (
     PasswordStrengthInput,
     PasswordConfirmationInput
 )
-from django_countries import widgets, countries
-from smartfields import fields
-import re
 
 from . import models
+from .passwords import PasswordPolicy
+from .validators import avatar_too_large, validate_avatar
+from .widgets import CachedCountrySelectWidget, country_choices
 
 
 class UserCreateForm(UserCreationForm):
@@ -45,7 +45,11 @@ class UserCreateForm(UserCreationForm):
 
 class UserProfileUpdateForm(forms.ModelForm):
     """Update user profile information."""
-    avatar = fields.ImageField(blank=True)
+    avatar = forms.FileField(
+        label=_('Your Photo'),
+        required=False,
+        validators=[validate_avatar]
+    )
     dob = forms.DateTimeField(label='Date of Birth',
                             input_formats=['%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y'],
                             widget=forms.SelectDateWidget(
@@ -59,8 +63,8 @@ class UserProfileUpdateForm(forms.ModelForm):
         widget=forms.TextInput(attrs={'placeholder': 'Enter city, state'}),
     )
     country = forms.ChoiceField(
-        widget=widgets.CountrySelectWidget,
-        choices=countries,
+        widget=CachedCountrySelectWidget,
+        choices=country_choices,
         label='Country of Residence'
     )
     fav_animal = forms.CharField(
@@ -82,9 +86,16 @@ class UserProfileUpdateForm(forms.ModelForm):
         model = models.UserProfile
         fields = ['avatar', 'dob', 'bio', 'location', 'country',
                 'fav_animal', 'hobby']
-        labels = {
-            'avatar': _('Your Photo'),
-        }
+
+    def __init__(self, *args, **kwargs):
+        # File fields the upload handler skipped for being too large
+        self.too_large_uploads = kwargs.pop('too_large_uploads', ())
+        super(UserProfileUpdateForm, self).__init__(*args, **kwargs)
+
+    def clean_avatar(self):
+        if 'avatar' in self.too_large_uploads:
+            raise avatar_too_large()
+        return self.cleaned_data.get('avatar')
 
 
 class UserUpdateForm(forms.ModelForm):
@@ -108,7 +119,8 @@ class UserUpdateForm(forms.ModelForm):
 
 class ValidatingPasswordChangeForm(PasswordChangeForm):
     """Form for changing user's password."""
-    MIN_LENGTH = 14
+    MIN_LENGTH = PasswordPolicy.MIN_LENGTH
+    policy = PasswordPolicy(MIN_LENGTH)
 
     new_password1 = forms.CharField(
         widget=PasswordStrengthInput(attrs={'placeholder': 'New password'}),
@@ -146,48 +158,10 @@ class ValidatingPasswordChangeForm(PasswordChangeForm):
         new_password = self.cleaned_data.get('new_password1')
         old_password = self.cleaned_data.get('old_password')
 
-        # Must not be the same as the current password
-        if user.check_password(old_password):
-            if new_password == old_password:
-                raise forms.ValidationError(
-                    "New password cannot match the old password.")
-        else:
-            raise forms.ValidationError("Your old password was entered "
-                "incorrectly. Please enter it again. ")
-
-        # Must use both uppercase and lowercase letters
-        if not re.search('([a-z])+', new_password) or \
-          not re.search('([A-Z])+', new_password):
-            raise forms.ValidationError("The new password must use both "
-                "uppercase and lowercase letters.")
-
-        # Minimum password length of 14 characters
-        if len(new_password) < self.MIN_LENGTH:
-            raise forms.ValidationError(
-                "The new password must be at least %d characters long." %
-                self.MIN_LENGTH
-            )
-
-        # Must include of one or more numerical digits
-        if not re.search('\d+', new_password):
-            raise forms.ValidationError("The new password must include one or "
-                "more numerical digits.")
-
-        # Must include of special characters, such as @, #, $
-        if not re.search('([@#$])+', new_password):
-            raise forms.ValidationError("The new password must include the at "
-                "least one of the following characters: @, #, or $.")
-
-        # Cannot contain the username or parts of the user’s full name, such
-        # as his first name
-        user_first_name = user.first_name.lower()
-        user_last_name = user.last_name.lower()
-        user_username = user.username.lower()
-
-        if (user_first_name in new_password.lower() or user_last_name in
-          new_password.lower() or user_username in new_password.lower()):
-            raise forms.ValidationError("The new password cannot contain your "
-                "username ({}) or parts of your full name ({} {}).".format(
-                    user.username, user.first_name, user.last_name))
+        # clean_old_password() has already checked the old password, so it
+        # is only in cleaned_data when it was entered correctly.
+        if old_password is None or new_password is None:
+            return self.cleaned_data
 
+        self.policy.validate(new_password, user, old_password)
         return self.cleaned_data
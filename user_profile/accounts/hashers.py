@@ -0,0 +1,32 @@
+"""Password hashers that keep count of how often and how long they run.
+
+Counters are cumulative per thread; callers take the difference between two
+readings of get_hasher_stats() to measure a single request.
+"""
+import threading
+import time
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+_local = threading.local()
+
+
+def get_hasher_stats():
+    """Return (calls, seconds) spent hashing passwords in this thread."""
+    return getattr(_local, 'calls', 0), getattr(_local, 'seconds', 0.0)
+
+
+class InstrumentedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2 hasher recording every hash it computes.
+
+    verify() calls encode(), so checking a password counts once as well.
+    """
+    def encode(self, password, salt, iterations=None):
+        started = time.time()
+        try:
+            return super(InstrumentedPBKDF2PasswordHasher, self).encode(
+                password, salt, iterations)
+        finally:
+            calls, seconds = get_hasher_stats()
+            _local.calls = calls + 1
+            _local.seconds = seconds + time.time() - started
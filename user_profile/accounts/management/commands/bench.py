@@ -0,0 +1,300 @@
+import json
+import math
+import platform
+import random
+import shutil
+import tempfile
+import time
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from PIL import Image
+
+from accounts import caching, tasks
+from accounts.hashers import InstrumentedPBKDF2PasswordHasher
+from accounts.models import User
+
+PASSWORD = 'Correct$Horse42Staple'
+NEW_PASSWORD = 'Correct$Horse43Staple'
+PROFILE_DATA = {
+    'dob': '1990-01-01',
+    'bio': 'Benchmarking the profile pages.',
+    'location': 'Auckland',
+    'country': 'NZ',
+    'fav_animal': 'Kiwi',
+    'hobby': 'Tramping',
+}
+
+
+def percentile(ordered, fraction):
+    """Return the nearest-rank percentile of a sorted list."""
+    return ordered[max(int(math.ceil(fraction * len(ordered))) - 1, 0)]
+
+
+def summarize(timings, errors, elapsed):
+    ordered = sorted(timings)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput': round(len(ordered) / elapsed, 2) if elapsed else None,
+        'mean_ms': ms(sum(ordered) / len(ordered)),
+        'min_ms': ms(ordered[0]),
+        'p50_ms': ms(percentile(ordered, 0.50)),
+        'p95_ms': ms(percentile(ordered, 0.95)),
+        'p99_ms': ms(percentile(ordered, 0.99)),
+        'max_ms': ms(ordered[-1]),
+    }
+
+
+def avatar_upload():
+    buf = BytesIO()
+    Image.new('RGB', (800, 600), (200, 80, 40)).save(buf, 'JPEG')
+    return SimpleUploadedFile('avatar.jpg', buf.getvalue(), 'image/jpeg')
+
+
+class Scenario(object):
+    """One flow to time. `request(i)` makes the i-th timed request and
+    returns its response; other status codes than `expected` are errors."""
+    expected = 302
+
+    def __init__(self, users):
+        self.users = users
+        self.client = Client()
+
+    def setup(self):
+        pass
+
+    def login(self, user):
+        self.client.login(email=user.email, password=PASSWORD)
+
+
+class SignUp(Scenario):
+    name = 'sign_up'
+
+    def request(self, i):
+        email = 'bench-signup-{}-{}@example.com'.format(i, time.time())
+        self.client.logout()
+        return self.client.post(reverse('accounts:sign_up'), {
+            'first_name': 'Bench', 'last_name': 'Signup', 'email': email,
+            'verify_email': email, 'password1': PASSWORD,
+            'password2': PASSWORD,
+        })
+
+
+class SignIn(Scenario):
+    name = 'sign_in'
+
+    def request(self, i):
+        self.client.logout()
+        return self.client.post(reverse('accounts:sign_in'), {
+            'username': random.choice(self.users).email,
+            'password': PASSWORD,
+        })
+
+
+class ProfileView(Scenario):
+    name = 'profile_view'
+    expected = 200
+
+    def setup(self):
+        self.login(self.users[0])
+
+    def request(self, i):
+        return self.client.get(reverse('accounts:profile'))
+
+
+class ProfileEdit(Scenario):
+    name = 'profile_edit'
+
+    def setup(self):
+        self.user = self.users[1 % len(self.users)]
+        self.login(self.user)
+
+    def data(self, i):
+        return dict(PROFILE_DATA, hobby='Hobby {}'.format(i),
+            first_name=self.user.first_name, last_name=self.user.last_name,
+            email=self.user.email, verify_email=self.user.email)
+
+    def request(self, i):
+        return self.client.post(reverse('accounts:edit_profile'),
+            self.data(i))
+
+
+class ProfileEditAvatar(ProfileEdit):
+    name = 'profile_edit_avatar'
+
+    def data(self, i):
+        return dict(super(ProfileEditAvatar, self).data(i),
+            avatar=avatar_upload())
+
+    def request(self, i):
+        response = super(ProfileEditAvatar, self).request(i)
+        # Time the variants too, as a worker would generate them. Their job
+        # has the highest priority, so it is the one run_pending() picks.
+        tasks.run_pending(limit=1)
+        return response
+
+
+class PasswordChange(Scenario):
+    name = 'password_change'
+
+    def setup(self):
+        self.user = self.users[2 % len(self.users)]
+        self.login(self.user)
+        self.passwords = [PASSWORD, NEW_PASSWORD]
+
+    def request(self, i):
+        old, new = self.passwords
+        self.passwords.reverse()
+        return self.client.post(reverse('accounts:change_password'), {
+            'old_password': old, 'new_password1': new,
+            'new_password2': new,
+        })
+
+
+SCENARIOS = [SignUp, SignIn, ProfileView, ProfileEdit, ProfileEditAvatar,
+    PasswordChange]
+
+
+def seed_users(count):
+    """Create `count` users sharing the benchmark password."""
+    User.objects.bulk_create_users([
+        {'first_name': 'Bench', 'last_name': 'User{}'.format(i),
+         'email': 'bench{}@example.com'.format(i), 'password': PASSWORD}
+        for i in range(count)
+    ])
+    return list(User.objects.filter(email__regex=r'^bench[0-9]+@')
+        .order_by('pk'))
+
+
+def run_benchmarks(users, iterations, warmup=5, names=None):
+    """Time each scenario against the current database.
+
+    Returns a dict of scenario name to its summary.
+    """
+    media_root = tempfile.mkdtemp()
+    cache_dir = tempfile.mkdtemp()
+    overrides = override_settings(
+        MEDIA_ROOT=media_root,
+        # Clearing the caches between scenarios must not empty the ones
+        # a server running from this checkout is using
+        CACHES=caching.relocated_caches(cache_dir),
+        # Repeated sign-ins from one client would otherwise be throttled
+        LOGIN_THROTTLE_RATES={},
+    )
+    results = {}
+    try:
+        with overrides:
+            seeded = seed_users(users)
+            for scenario_class in SCENARIOS:
+                if names and scenario_class.name not in names:
+                    continue
+                for cache in caches.all():
+                    cache.clear()
+                scenario = scenario_class(seeded)
+                scenario.setup()
+                for i in range(warmup):
+                    scenario.request(-1 - i)
+                timings, errors = [], 0
+                started = time.perf_counter()
+                for i in range(iterations):
+                    request_started = time.perf_counter()
+                    response = scenario.request(i)
+                    timings.append(time.perf_counter() - request_started)
+                    if response.status_code != scenario.expected:
+                        errors += 1
+                results[scenario_class.name] = summarize(timings, errors,
+                    time.perf_counter() - started)
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the sign-up, sign-in and profile flows in-process "
+            "against a throwaway test database, reporting throughput and "
+            "latency percentiles as JSON. Use --settings to benchmark "
+            "another database backend.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+            help='Synthetic users to create before timing (default 1000).')
+        parser.add_argument('--iterations', type=int, default=100,
+            help='Timed requests per scenario (default 100).')
+        parser.add_argument('--warmup', type=int, default=5,
+            help='Untimed requests per scenario (default 5).')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+            choices=[scenario.name for scenario in SCENARIOS],
+            help='Scenario to run; repeat for several (default: all).')
+        parser.add_argument('--hasher-iterations', type=int,
+            help='PBKDF2 iterations, to separate hashing cost from the '
+                 'rest of the request (default: Django\'s).')
+        parser.add_argument('--db-file',
+            help='Put the SQLite test database in this file instead of in '
+                 'memory, to include disk I/O.')
+        parser.add_argument('--seed', type=int, default=0,
+            help='Random seed for picking users (default 0).')
+        parser.add_argument('--output',
+            help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['users'] < 1:
+            raise CommandError("--iterations and --users must be at least 1.")
+        random.seed(options['seed'])
+        if options['hasher_iterations']:
+            InstrumentedPBKDF2PasswordHasher.iterations = \
+                options['hasher_iterations']
+        if options['db_file']:
+            settings.DATABASES['default'].setdefault('TEST', {})['NAME'] = \
+                options['db_file']
+
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            results = run_benchmarks(options['users'],
+                options['iterations'], options['warmup'],
+                options['scenarios'])
+        finally:
+            runner.teardown_databases(old_config)
+
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'database_file': options['db_file'],
+                'hasher': settings.PASSWORD_HASHERS[0],
+                'hasher_iterations':
+                    InstrumentedPBKDF2PasswordHasher.iterations,
+            },
+            'parameters': {
+                'users': options['users'],
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'seed': options['seed'],
+            },
+            'scenarios': results,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True) + '\n'
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            for name, result in sorted(results.items()):
+                self.stderr.write("{:<20} {:>8.1f} req/s  p50 {:>8.2f}ms  "
+                    "p95 {:>8.2f}ms  p99 {:>8.2f}ms".format(name,
+                        result['throughput'], result['p50_ms'],
+                        result['p95_ms'], result['p99_ms']))
+        else:
+            self.stdout.write(output, ending='')
@@ -0,0 +1,23 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts import assets
+
+
+class Command(BaseCommand):
+    help = ("Bundle, minify and precompress the stylesheets and scripts "
+            "listed in ASSET_BUNDLES.")
+
+    def handle(self, *args, **options):
+        manifest = assets.build_assets()
+        for name, built in sorted(manifest.items()):
+            size = os.path.getsize(
+                os.path.join(settings.ASSET_SOURCE_DIR, built))
+            gz_size = os.path.getsize(
+                os.path.join(settings.ASSET_SOURCE_DIR, built + '.gz'))
+            self.stdout.write("{} -> {} ({} bytes, {} gzipped)".format(
+                name, built, size, gz_size))
+        self.stdout.write(self.style.SUCCESS(
+            "Wrote {}".format(assets.get_manifest_path())))
@@ -0,0 +1,38 @@
+import gzip
+import os
+
+from django.core.management.base import BaseCommand
+
+from accounts.passwords import DEFAULT_PASSWORD_LIST_PATH, normalize
+
+
+class Command(BaseCommand):
+    help = ("Build the sorted common-password file read by "
+            "MappedCommonPasswordValidator from one or more password lists "
+            "(plain text or gzipped, one password per line).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('sources', nargs='+')
+        parser.add_argument('--output', default=DEFAULT_PASSWORD_LIST_PATH,
+            help="File to write (default: the validator's default list)")
+
+    def handle(self, *args, **options):
+        passwords = set()
+        for source in options['sources']:
+            opener = gzip.open if source.endswith('.gz') else open
+            with opener(source, 'rb') as f:
+                for line in f:
+                    password = normalize(line.decode('utf-8', 'replace'))
+                    if password:
+                        passwords.add(password.encode('utf-8'))
+
+        # Written to a temporary file and renamed into place, so processes
+        # that have the old list mapped keep reading a complete file.
+        output = options['output']
+        temporary = output + '.tmp'
+        with open(temporary, 'wb') as f:
+            for password in sorted(passwords):
+                f.write(password + b'\n')
+        os.replace(temporary, output)
+        self.stdout.write(self.style.SUCCESS(
+            "Wrote {} passwords to {}".format(len(passwords), output)))
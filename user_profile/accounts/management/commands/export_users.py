@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from accounts import exports
+from accounts.models import User
+
+
+def parse_moment(value):
+    """Parse a date or datetime option into an aware datetime."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError("'{}' is not a valid date.".format(value))
+        moment = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = "Export users and their profiles as CSV or JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(exports.FORMATS),
+            default='csv')
+        parser.add_argument('--output',
+            help='File to write to. Defaults to standard output.')
+        parser.add_argument('--since',
+            help='Only users who joined at or after this date or datetime.')
+        parser.add_argument('--until',
+            help='Only users who joined before this date or datetime.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+            help='Number of rows read from the database at a time.')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['since']:
+            users = users.filter(
+                date_joined__gte=parse_moment(options['since']))
+        if options['until']:
+            users = users.filter(
+                date_joined__lt=parse_moment(options['until']))
+
+        lines = exports.export_users(users, options['format'],
+            options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
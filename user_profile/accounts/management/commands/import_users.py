@@ -0,0 +1,121 @@
+import csv
+import json
+import os
+import time
+from itertools import chain, islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from accounts.models import User
+
+
+def read_csv(stream):
+    """Yield one dict per CSV row, using the header row as keys."""
+    for row in csv.DictReader(stream):
+        yield row
+
+
+def read_jsonl(stream):
+    """Yield one dict per non-blank JSON line."""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+class Command(BaseCommand):
+    help = ("Bulk import users from a CSV or JSONL file with first_name, "
+            "last_name, email and optional username and password columns.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import.')
+        parser.add_argument('--format', choices=sorted(READERS),
+            help='Input format. Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='Number of users written per transaction.')
+        parser.add_argument('--workers', type=int, default=None,
+            help='Password hashing processes. Defaults to the CPU count; '
+                 '0 hashes in this process.')
+        parser.add_argument('--checkpoint',
+            help='File recording committed rows, used to resume an '
+                 'interrupted import. Defaults to <path>.checkpoint.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or \
+            os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError("Unknown input format '{}'.".format(
+                file_format))
+        checkpoint = options['checkpoint'] or path + '.checkpoint'
+
+        done = 0
+        if os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                done = int(f.read().strip() or 0)
+            self.stdout.write("Resuming after {} rows.".format(done))
+
+        started = time.time()
+        skipped = 0
+
+        def report(total):
+            # Written after the batch commits, so a crash in between leaves
+            # the checkpoint one batch behind; see _skip_imported()
+            with open(checkpoint, 'w') as f:
+                f.write(str(done + skipped + total))
+            elapsed = time.time() - started
+            self.stdout.write("Imported {} users ({:.0f} rows/sec)".format(
+                done + skipped + total, total / elapsed if elapsed else 0))
+
+        with open(path, newline='') as stream:
+            rows = islice(READERS[file_format](stream), done, None)
+            # Even without a checkpoint: the crash may have come before the
+            # first one was written
+            rows, skipped = self._skip_imported(rows, options['batch_size'])
+            if skipped:
+                self.stdout.write("Skipped {} rows imported before the "
+                    "checkpoint was written.".format(skipped))
+            try:
+                total = User.objects.bulk_create_users(
+                    rows,
+                    batch_size=options['batch_size'],
+                    workers=options['workers'],
+                    callback=report
+                )
+            except (IntegrityError, ValueError) as e:
+                raise CommandError("Import stopped after {} rows: {}".format(
+                    self._read_checkpoint(checkpoint, done + skipped), e))
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = time.time() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Created {} users in {:.1f}s ({:.0f} rows/sec).".format(
+                total, elapsed, total / elapsed if elapsed else 0)))
+
+    def _skip_imported(self, rows, batch_size):
+        """Drop the rows of the next batch whose users already exist.
+
+        Returns the remaining rows and the number dropped.
+        """
+        batch = list(islice(rows, batch_size))
+        emails = [User.objects.normalize_email(row.get('email') or '')
+            for row in batch]
+        existing = set(User.objects.filter(email__in=emails)
+            .values_list('email', flat=True))
+        remaining = [row for row, email in zip(batch, emails)
+            if email not in existing]
+        return chain(remaining, rows), len(batch) - len(remaining)
+
+    def _read_checkpoint(self, checkpoint, default):
+        if not os.path.exists(checkpoint):
+            return default
+        with open(checkpoint) as f:
+            return int(f.read().strip() or default)
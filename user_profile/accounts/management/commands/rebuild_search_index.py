@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from accounts import search
+from accounts.models import User, UserProfile
+
+
+class Command(BaseCommand):
+    help = "Rebuild the admin user search index from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='Number of users reindexed per transaction.')
+
+    def handle(self, *args, **options):
+        users = User.objects.select_related('userprofile').order_by('pk')
+        last_pk = 0
+        total = 0
+        while True:
+            batch = list(users.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            search.index_users(
+                (user, self._profile(user)) for user in batch)
+            last_pk = batch[-1].pk
+            total += len(batch)
+            self.stdout.write("Indexed {} users".format(total))
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt the search index for {} users.".format(total)))
+
+    def _profile(self, user):
+        try:
+            return user.userprofile
+        except UserProfile.DoesNotExist:
+            return None
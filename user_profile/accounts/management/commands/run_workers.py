@@ -0,0 +1,93 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from accounts import tasks
+
+logger = logging.getLogger(__name__)
+
+
+# Longest wait after repeated errors reaching the database
+MAX_BACKOFF = 60
+
+
+def work(poll_interval, once):
+    """Run due jobs, then wait for more.
+
+    Each poll also requeues jobs left running by workers that died. An
+    error (such as a locked database) is logged and the worker waits,
+    twice as long after each consecutive error, before polling again.
+    """
+    worker = tasks.worker_name()
+    errors = 0
+    while True:
+        try:
+            requeued = tasks.requeue_stale()
+            if requeued:
+                logger.warning("Requeued %d stale job(s)", requeued)
+            count = tasks.run_pending(worker)
+        except Exception:
+            logger.exception("Worker %s could not run jobs", worker)
+            if once:
+                return
+            errors += 1
+            time.sleep(min(poll_interval * 2 ** errors, MAX_BACKOFF))
+            continue
+        errors = 0
+        if once:
+            return
+        if not count:
+            time.sleep(poll_interval)
+
+
+def work_in_child(poll_interval, once):
+    # The parent handles Ctrl-C and stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    work(poll_interval, once)
+
+
+class Command(BaseCommand):
+    help = ("Run queued background jobs (avatar variants, emails, ...) in "
+            "a pool of worker processes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2,
+            help='Worker processes (default 2).')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+            help='Seconds an idle worker waits before checking for new '
+                 'jobs (default 1).')
+        parser.add_argument('--once', action='store_true',
+            help='Run the jobs that are due and exit.')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            try:
+                work(options['poll_interval'], options['once'])
+            except KeyboardInterrupt:
+                pass
+        else:
+            # Connections must not be shared with the forked workers
+            connections.close_all()
+            workers = [multiprocessing.Process(target=work_in_child,
+                    args=(options['poll_interval'], options['once']))
+                for i in range(options['processes'])]
+            for worker in workers:
+                worker.start()
+            try:
+                for worker in workers:
+                    worker.join()
+            except KeyboardInterrupt:
+                for worker in workers:
+                    worker.terminate()
+                    worker.join()
+
+        for name, stats in sorted(tasks.task_stats().items()):
+            self.stdout.write("{}: {} done, {} failed, {} queued{}".format(
+                name, stats[tasks.DONE], stats[tasks.FAILED],
+                stats[tasks.QUEUED],
+                ", mean {:.1f}ms".format(stats['mean_ms'])
+                if stats['mean_ms'] is not None else ''))
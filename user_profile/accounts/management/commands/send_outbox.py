@@ -0,0 +1,32 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from accounts import outbox
+
+
+class Command(BaseCommand):
+    help = ("Send the queued account emails over one SMTP connection and "
+            "report the send rate. run_workers does the same as emails are "
+            "queued; this command is for draining the outbox by hand or "
+            "from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+            help='Emails fetched per query (default OUTBOX_BATCH_SIZE).')
+        parser.add_argument('--loop', action='store_true',
+            help='Keep checking the outbox instead of exiting once empty.')
+        parser.add_argument('--interval', type=float, default=5.0,
+            help='Seconds between checks with --loop (default 5).')
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        while True:
+            stats = outbox.send_pending(connection, options['batch_size'])
+            self.stdout.write("Sent {sent} email(s) in {seconds:.2f}s "
+                "({rate:.1f}/s), {deferred} deferred, {failed} failed".format(
+                    **stats))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
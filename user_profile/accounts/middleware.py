@@ -0,0 +1,167 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from . import hashers
+from .templating import get_render_time
+
+logger = logging.getLogger(__name__)
+
+
+class BudgetExceeded(Exception):
+    """A request went over its REQUEST_BUDGETS entry."""
+
+
+class PasswordHasherStatsMiddleware(object):
+    """Report how many passwords were hashed while handling a request."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        calls_before, seconds_before = hashers.get_hasher_stats()
+        response = self.get_response(request)
+        calls, seconds = hashers.get_hasher_stats()
+        calls -= calls_before
+        seconds -= seconds_before
+
+        response['X-Password-Hasher-Calls'] = str(calls)
+        if calls:
+            logger.info("%s %s hashed %d password(s) in %.1fms",
+                request.method, request.path, calls, seconds * 1000)
+        return response
+
+
+class RequestMetricsMiddleware(object):
+    """Measure the queries, DB time, template time and hashing time of
+    each request.
+
+    The figures are sent in a Server-Timing header and logged against the
+    URL name. Views listed in REQUEST_BUDGETS are checked against their
+    limits; going over one is logged, or raises BudgetExceeded when
+    REQUEST_BUDGET_ACTION is 'raise'.
+
+    Queries are counted and timed by wrapping the cursors each connection
+    hands out during the request; nothing is added to the query log.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        meter = QueryMeter()
+        hashing_before = hashers.get_hasher_stats()[1]
+        rendering_before = get_render_time()
+        started = time.time()
+        with metered_cursors(meter):
+            response = self.get_response(request)
+
+        metrics = {
+            'queries': meter.count,
+            'db_ms': meter.seconds * 1000,
+            'template_ms': (get_render_time() - rendering_before) * 1000,
+            'hashing_ms':
+                (hashers.get_hasher_stats()[1] - hashing_before) * 1000,
+            'total_ms': (time.time() - started) * 1000,
+        }
+        view_name = get_view_name(request)
+        response['Server-Timing'] = server_timing(metrics)
+        logger.info(
+            "view=%s method=%s status=%d queries=%d db_ms=%.1f "
+            "template_ms=%.1f hashing_ms=%.1f total_ms=%.1f",
+            view_name, request.method, response.status_code,
+            metrics['queries'], metrics['db_ms'], metrics['template_ms'],
+            metrics['hashing_ms'], metrics['total_ms'],
+            extra={'view': view_name, 'metrics': metrics})
+        self.check_budget(view_name, metrics)
+        return response
+
+    def check_budget(self, view_name, metrics):
+        budget = getattr(settings, 'REQUEST_BUDGETS', {}).get(view_name)
+        if not budget:
+            return
+        exceeded = ['{} {} > {}'.format(key, round(metrics[key], 1), limit)
+            for key, limit in sorted(budget.items()) if metrics[key] > limit]
+        if not exceeded:
+            return
+        message = "{} over budget: {}".format(view_name, ', '.join(exceeded))
+        if getattr(settings, 'REQUEST_BUDGET_ACTION', 'log') == 'raise':
+            raise BudgetExceeded(message)
+        logger.warning(message,
+            extra={'view': view_name, 'metrics': metrics})
+
+
+class QueryMeter(object):
+    """The number of queries run, and the seconds they took."""
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+class MeteredCursor(object):
+    """A database cursor that reports its queries to a QueryMeter."""
+    def __init__(self, cursor, meter):
+        self.cursor = cursor
+        self.meter = meter
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def _timed(self, method, *args):
+        started = time.time()
+        try:
+            return method(*args)
+        finally:
+            self.meter.count += 1
+            self.meter.seconds += time.time() - started
+
+    def execute(self, *args):
+        return self._timed(self.cursor.execute, *args)
+
+    def executemany(self, *args):
+        return self._timed(self.cursor.executemany, *args)
+
+
+@contextmanager
+def metered_cursors(meter):
+    """Report every query run on any connection, within the block, to
+    `meter`.
+
+    The cursors Django creates are wrapped before its own (debug) cursor
+    wrappers see them, so query logging is left as it was.
+    """
+    wrapped = []
+    for connection in connections.all():
+        for name in ('make_cursor', 'make_debug_cursor'):
+            make = getattr(connection, name)
+            setattr(connection, name,
+                lambda cursor, make=make: make(MeteredCursor(cursor, meter)))
+            wrapped.append((connection, name))
+    try:
+        yield
+    finally:
+        for connection, name in wrapped:
+            # Back to the method of the connection's class
+            delattr(connection, name)
+
+
+def get_view_name(request):
+    """Return the namespaced URL name of the view that handled a request."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '-'
+    return match.view_name
+
+
+def server_timing(metrics):
+    return ', '.join([
+        'db;dur={:.1f};desc="{} queries"'.format(
+            metrics['db_ms'], metrics['queries']),
+        'tpl;dur={:.1f}'.format(metrics['template_ms']),
+        'hash;dur={:.1f}'.format(metrics['hashing_ms']),
+        'total;dur={:.1f}'.format(metrics['total_ms']),
+    ])
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 10:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django_countries.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_usersearchtoken'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='country',
+            field=django_countries.fields.CountryField(blank=True, db_index=True, max_length=2, null=True),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='location',
+            field=models.CharField(blank=True, db_index=True, max_length=40, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='user',
+            index_together=set([('date_joined', 'id')]),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from accounts import search
+
+BATCH_SIZE = 1000
+
+
+def index_existing_users(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    UserSearchToken = apps.get_model('accounts', 'UserSearchToken')
+    last_pk = 0
+    while True:
+        users = list(User.objects.filter(pk__gt=last_pk)
+            .order_by('pk')[:BATCH_SIZE])
+        if not users:
+            break
+        profiles = {profile.user_id: profile for profile in
+            UserProfile.objects.filter(user__in=users)}
+        search.index_users(((user, profiles.get(user.pk)) for user in users),
+            token_model=UserSearchToken)
+        last_pk = users[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_outboundemail_claim'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_existing_users,
+            migrations.RunPython.noop),
+    ]
@@ -1,10 +1,18 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
-    PermissionsMixin
+    PermissionsMixin,
+    update_last_login
 )
-from django.db import models
-from django.db.models.signals import post_save
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.sessions.base_session import AbstractBaseSession
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
 from django.conf import settings
 from django.core.urlresolvers import reverse
@@ -12,11 +20,18 @@ from django.core.urlresolvers import reverse
 from smartfields import fields
 from django_countries.fields import CountryField
 
+from . import avatars
+from . import caching
+from . import outbox
+from . import search
+from . import tasks
+from . import writebehind
+from .tracking import ChangeTrackingMixin
+
 
 class UserManager(BaseUserManager):
     """Create and manage users."""
-    def create_user(self, first_name, last_name, email,
-                    username=None, password=None):
+    def _build_user(self, first_name, last_name, email, username=None):
         if not email:
             raise ValueError("Users must have an email address")
         if not first_name:
@@ -26,16 +41,74 @@ class UserManager(BaseUserManager):
         if not username:
             username = email.split('@')[0]
 
-        user = self.model(
+        return self.model(
             first_name=first_name,
             last_name=last_name,
             email=self.normalize_email(email),
             username=username
         )
+
+    def create_user(self, first_name, last_name, email,
+                    username=None, password=None):
+        user = self._build_user(first_name, last_name, email, username)
         user.set_password(password)
         user.save()
         return user
 
+    def bulk_create_users(self, rows, batch_size=500, workers=None,
+                          callback=None):
+        """Create users and their profiles from an iterable of dicts.
+
+        Rows are consumed lazily, passwords are hashed in a pool of
+        `workers` processes (in this process when `workers` is 0) and every
+        batch of users and profiles is written in one transaction, bypassing
+        the per-user post_save signal. `callback` is called with the running
+        total after each committed batch. Returns the number of users created.
+        """
+        rows = iter(rows)
+        executor = ProcessPoolExecutor(workers) if workers != 0 else None
+        total = 0
+        try:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                users = [
+                    self._build_user(row.get('first_name'),
+                                     row.get('last_name'), row.get('email'),
+                                     row.get('username'))
+                    for row in batch
+                ]
+                # Blank passwords become unusable ones, as in set_password()
+                passwords = [row.get('password') or None for row in batch]
+                if executor is not None:
+                    hashes = executor.map(make_password, passwords,
+                        chunksize=max(1, len(passwords) // 32))
+                else:
+                    hashes = map(make_password, passwords)
+                for user, password in zip(users, hashes):
+                    user.password = password
+
+                with transaction.atomic(using=self.db):
+                    self.bulk_create(users)
+                    # bulk_create() does not set primary keys on every
+                    # backend, so look the new rows up by their unique email.
+                    user_ids = dict(self.filter(
+                        email__in=[user.email for user in users]
+                    ).values_list('email', 'pk'))
+                    for user in users:
+                        user.pk = user_ids[user.email]
+                    UserProfile.objects.bulk_create(
+                        [UserProfile(user_id=user.pk) for user in users])
+                    search.index_users((user, None) for user in users)
+                total += len(users)
+                if callback is not None:
+                    callback(total)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return total
+
     def create_superuser(self, first_name, last_name, email, password,
         username=None):
         user = self.create_user(
@@ -51,7 +124,7 @@ class UserManager(BaseUserManager):
         return user
 
 
-class User(AbstractBaseUser, PermissionsMixin):
+class User(ChangeTrackingMixin, AbstractBaseUser, PermissionsMixin):
     """User model data."""
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
@@ -60,12 +133,17 @@ class User(AbstractBaseUser, PermissionsMixin):
     date_joined = models.DateTimeField(default=timezone.now)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name']
 
+    class Meta:
+        # Keyset pagination of the profile directory
+        index_together = [('date_joined', 'id')]
+
     def __str__(self):
         return "@{}".format(self.username)
 
@@ -77,16 +155,122 @@ class User(AbstractBaseUser, PermissionsMixin):
             self.username)
 
 
-class UserProfile(models.Model):
+class UserProfile(ChangeTrackingMixin, models.Model):
     """User profile data."""
     user = models.OneToOneField(settings.AUTH_USER_MODEL)
     dob = models.DateTimeField(blank=True, null=True)
     bio = models.CharField(max_length=140, blank=True, null=True)
     avatar = fields.ImageField(upload_to='avatar_photos/', blank=True, null=True)
-    location = models.CharField(max_length=40, blank=True, null=True)
-    country = CountryField(blank=True, null=True)
+    location = models.CharField(max_length=40, blank=True, null=True,
+        db_index=True)
+    country = CountryField(blank=True, null=True, db_index=True)
     fav_animal = models.CharField(max_length=40, blank=True, null=True)
     hobby = models.CharField(max_length=40, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def last_modified(self):
+        """When the user or this profile last changed."""
+        return max(self.updated_at, self.user.updated_at)
+
+    @property
+    def avatar_variants(self):
+        if not self.avatar:
+            return None
+        return avatars.AvatarVariants(self.avatar)
+
+
+class UserSearchToken(models.Model):
+    """A normalized word a user can be found by in the admin search."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=search.TOKEN_MAX_LENGTH)
+
+    class Meta:
+        # Also serves prefix lookups as range scans over (token, user_id)
+        unique_together = ('token', 'user')
+
+
+class UserSession(AbstractBaseSession):
+    """A session, with the user signed in to it (if any)."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True,
+        on_delete=models.CASCADE, related_name='sessions')
+
+    @classmethod
+    def get_session_store_class(cls):
+        from .sessions import SessionStore
+        return SessionStore
+
+
+class Job(models.Model):
+    """A queued call of a task registered in accounts.tasks."""
+    STATUS_CHOICES = (
+        (tasks.QUEUED, 'Queued'),
+        (tasks.RUNNING, 'Running'),
+        (tasks.DONE, 'Done'),
+        (tasks.FAILED, 'Failed'),
+    )
+    name = models.CharField(max_length=100)
+    payload = models.TextField(default='{}')
+    priority = models.IntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+        default=tasks.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        # Serves the workers' "next due job" lookup
+        index_together = [('status', 'priority', 'run_at')]
+
+    def __str__(self):
+        return '{} #{} ({})'.format(self.name, self.pk, self.status)
+
+    @property
+    def payload_data(self):
+        return json.loads(self.payload)
+
+
+class OutboundEmail(models.Model):
+    """An account email waiting in (or sent from) the outbox."""
+    STATUS_CHOICES = (
+        (outbox.QUEUED, 'Queued'),
+        (outbox.SENDING, 'Sending'),
+        (outbox.SENT, 'Sent'),
+        (outbox.FAILED, 'Failed'),
+    )
+    kind = models.CharField(max_length=30)
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+        default=outbox.QUEUED)
+    # Set while queued, so the same email is not queued twice
+    dedup_key = models.CharField(max_length=255, unique=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    send_after = models.DateTimeField(default=timezone.now)
+    # The drain sending the email, and when it claimed it
+    locked_by = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        index_together = [
+            ('status', 'send_after'),
+            # Serves the per-recipient throttle
+            ('recipient', 'sent_at'),
+        ]
+
+    def __str__(self):
+        return '{} to {} ({})'.format(self.kind, self.recipient, self.status)
 
 
 def create_user_profile(sender, instance, created, **kwargs):
@@ -94,3 +278,53 @@ def create_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.create(user=instance)
 
 post_save.connect(create_user_profile, sender=User)
+
+
+def process_avatar(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    if instance.avatar and not instance.avatar_variants.ready:
+        avatars.schedule_variants(instance)
+
+post_save.connect(process_avatar, sender=UserProfile)
+
+
+# The fields accounts.search.user_tokens() reads
+SEARCH_FIELDS = {
+    User: {'email', 'first_name', 'last_name', 'username'},
+    UserProfile: {'location', 'country'},
+}
+
+
+def index_user_for_search(sender, instance, created, update_fields=None,
+                          **kwargs):
+    if update_fields is not None and \
+            not SEARCH_FIELDS[sender].intersection(update_fields):
+        return
+    if sender is User:
+        search.index_user(instance)
+    elif not created:
+        # New profiles are indexed along with the user that created them
+        search.index_user(instance.user)
+
+post_save.connect(index_user_for_search, sender=User)
+post_save.connect(index_user_for_search, sender=UserProfile)
+
+
+def invalidate_cached_profile(sender, instance, **kwargs):
+    user_id = instance.pk if sender is User else instance.user_id
+    caching.invalidate_user(user_id)
+
+post_save.connect(invalidate_cached_profile, sender=User)
+post_save.connect(invalidate_cached_profile, sender=UserProfile)
+post_delete.connect(invalidate_cached_profile, sender=User)
+post_delete.connect(invalidate_cached_profile, sender=UserProfile)
+
+
+def record_last_login(sender, user, **kwargs):
+    user.last_login = timezone.now()
+    writebehind.last_logins.record(user.pk, last_login=user.last_login)
+
+# last_login is written in batches rather than saved on every sign-in
+user_logged_in.disconnect(update_last_login)
+user_logged_in.connect(record_last_login)
@@ -0,0 +1,193 @@
+"""Outbox for account notification emails.
+
+Views call queue_email(), which renders the message into an
+OutboundEmail row and queues a send_outbox job, so no request waits on
+SMTP. send_pending() drains the outbox in batches over a single
+connection that stays open for as long as there is mail to send.
+
+Each drain claims a batch (marks it as sending, under its own name)
+before sending it, so concurrent drains never send the same email twice.
+
+The same kind of email to the same recipient is only queued once at a
+time. No recipient gets more than OUTBOX_RECIPIENT_RATE emails per
+period; anything over that is held back until the period has passed.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import tasks
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+def queue_email(kind, recipient, context=None, dedup=''):
+    """Queue the `kind` email for `recipient`.
+
+    The message is rendered from accounts/email/<kind>_subject.txt and
+    accounts/email/<kind>.txt. Returns the OutboundEmail, or None if the
+    same email (same kind, recipient and `dedup` value) is still queued.
+    """
+    from .models import OutboundEmail
+
+    context = context or {}
+    subject = render_to_string(
+        'accounts/email/{}_subject.txt'.format(kind), context)
+    try:
+        with transaction.atomic():
+            email = OutboundEmail.objects.create(
+                kind=kind,
+                recipient=recipient,
+                # Subjects must be a single line
+                subject=' '.join(subject.split()),
+                body=render_to_string(
+                    'accounts/email/{}.txt'.format(kind), context),
+                dedup_key='{}:{}:{}'.format(kind, recipient.lower(), dedup),
+            )
+    except IntegrityError:
+        return None
+    send_outbox.delay()
+    return email
+
+
+def throttled_recipients(recipients):
+    """Return the recipients that have had their share of email."""
+    from .models import OutboundEmail
+
+    limit, period = getattr(settings, 'OUTBOX_RECIPIENT_RATE', (5, 3600))
+    since = timezone.now() - timedelta(seconds=period)
+    counts = (OutboundEmail.objects
+        .filter(recipient__in=recipients, status=SENT, sent_at__gte=since)
+        .values_list('recipient').annotate(sent=Count('pk')).order_by())
+    return {recipient for recipient, sent in counts if sent >= limit}
+
+
+def claim(worker, last_pk, batch_size):
+    """Mark the next due emails after `last_pk` as sending for `worker`.
+
+    Returns the highest pk looked at (None when there were none left) and
+    the emails claimed, which exclude any another drain claimed first.
+    """
+    from .models import OutboundEmail
+
+    ids = list(OutboundEmail.objects
+        .filter(status=QUEUED, send_after__lte=timezone.now(),
+            pk__gt=last_pk)
+        .order_by('pk').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return None, []
+    OutboundEmail.objects.filter(pk__in=ids, status=QUEUED).update(
+        status=SENDING, locked_by=worker, claimed_at=timezone.now())
+    return ids[-1], list(OutboundEmail.objects
+        .filter(pk__in=ids, status=SENDING, locked_by=worker).order_by('pk'))
+
+
+def requeue_stale(timeout=None):
+    """Return emails left sending by a drain that died to the queue.
+    Returns how many were requeued."""
+    from .models import OutboundEmail
+
+    if timeout is None:
+        timeout = getattr(settings, 'TASK_LOCK_TIMEOUT', 600)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return OutboundEmail.objects.filter(status=SENDING,
+        claimed_at__lt=cutoff).update(status=QUEUED, locked_by='')
+
+
+def send_pending(connection=None, batch_size=None, worker=None):
+    """Send every due email in the outbox over one connection.
+
+    Returns a dict with the number of emails sent, deferred by the
+    throttle and failed, the seconds taken and the send rate per second.
+    """
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+    max_attempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 3)
+    period = getattr(settings, 'OUTBOX_RECIPIENT_RATE', (5, 3600))[1]
+    worker = worker or tasks.worker_name()
+    connection = connection or get_connection()
+    stats = {'sent': 0, 'deferred': 0, 'failed': 0}
+    started = time.perf_counter()
+    requeue_stale()
+    last_pk = 0
+    opened = connection.open()
+    try:
+        while True:
+            # Walking the queue by pk passes each email once, even those
+            # deferred or failed and left queued
+            last_pk, batch = claim(worker, last_pk, batch_size)
+            if last_pk is None:
+                break
+            throttled = throttled_recipients(
+                {email.recipient for email in batch})
+            for email in batch:
+                if email.recipient in throttled:
+                    email.status = QUEUED
+                    email.locked_by = ''
+                    email.send_after = timezone.now() + timedelta(
+                        seconds=period)
+                    email.save(update_fields=['status', 'locked_by',
+                        'send_after'])
+                    stats['deferred'] += 1
+                    continue
+                _send(email, connection, max_attempts, stats)
+    finally:
+        if opened:
+            connection.close()
+
+    stats['seconds'] = time.perf_counter() - started
+    stats['rate'] = stats['sent'] / stats['seconds'] if stats['seconds'] \
+        else 0.0
+    if stats['sent'] or stats['failed']:
+        logger.info("Sent %d email(s) in %.2fs (%.1f/s), %d deferred, "
+            "%d failed", stats['sent'], stats['seconds'], stats['rate'],
+            stats['deferred'], stats['failed'])
+    return stats
+
+
+def _send(email, connection, max_attempts, stats):
+    message = EmailMessage(email.subject, email.body,
+        settings.DEFAULT_FROM_EMAIL, [email.recipient],
+        connection=connection)
+    email.attempts += 1
+    email.locked_by = ''
+    try:
+        connection.send_messages([message])
+    except Exception as exc:
+        logger.exception("Could not send %s", email)
+        email.last_error = repr(exc)
+        if email.attempts >= max_attempts:
+            email.status = FAILED
+            email.dedup_key = None
+            stats['failed'] += 1
+        else:
+            email.status = QUEUED
+            email.send_after = timezone.now() + timedelta(
+                minutes=email.attempts)
+        email.save(update_fields=['status', 'dedup_key', 'attempts',
+            'locked_by', 'last_error', 'send_after'])
+        return
+    email.status = SENT
+    email.sent_at = timezone.now()
+    email.dedup_key = None
+    email.save(update_fields=['status', 'sent_at', 'dedup_key', 'attempts',
+        'locked_by'])
+    stats['sent'] += 1
+
+
+# Jobs queued by several queue_email() calls are claimed together and
+# handled by one drain of the outbox.
+@tasks.task(batch_size=100)
+def send_outbox(payloads):
+    send_pending()
@@ -0,0 +1,29 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+
+COUNT_KEY = 'accounts:count:{}'
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator reusing the object count of an identical query for
+    COUNT_CACHE_TIMEOUT seconds instead of running COUNT(*) on every page.
+
+    Counts may lag behind inserts and deletes by up to the timeout.
+    """
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super(CachedCountPaginator, self).count
+        sql, params = self.object_list.order_by().query.sql_with_params()
+        key = COUNT_KEY.format(hashlib.md5(
+            repr((sql, params)).encode('utf-8')).hexdigest())
+        cache = caches[getattr(settings, 'COUNT_CACHE_ALIAS', 'default')]
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, getattr(settings, 'COUNT_CACHE_TIMEOUT', 60))
+        return count
@@ -0,0 +1,139 @@
+"""Password rules and common-password checking.
+
+PasswordPolicy holds the rules ValidatingPasswordChangeForm enforces, with
+their regular expressions compiled once.
+
+MappedCommonPasswordValidator replaces Django's CommonPasswordValidator.
+Instead of loading the whole list into a set in every worker, it
+memory-maps a sorted, newline-separated file (see `manage.py
+build_password_list`) and binary-searches it. Lookups touch a few pages of
+the file, which the OS shares between all processes mapping it, so lists
+of millions of breached passwords cost no per-worker memory.
+"""
+import mmap
+import os
+import re
+import threading
+
+from django.core.exceptions import ValidationError
+from django.utils.translation import ugettext as _
+
+DEFAULT_PASSWORD_LIST_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data',
+    'common-passwords.txt')
+
+
+def normalize(password):
+    """Return the form passwords are stored in the common-password list."""
+    return password.lower().strip()
+
+
+class SortedPasswordList(object):
+    """Membership test over a sorted, newline-separated file of passwords.
+
+    The file must be sorted by its UTF-8 bytes, which build_password_list
+    guarantees. It is mapped on first use.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        with self._lock:
+            if self._map is None:
+                with open(self.path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        self._map = b''
+                    else:
+                        self._map = mmap.mmap(f.fileno(), 0,
+                            access=mmap.ACCESS_READ)
+        return self._map
+
+    def __contains__(self, password):
+        data = self._map if self._map is not None else self._open()
+        target = password.encode('utf-8')
+        lo, hi = 0, len(data)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            # lo is always the start of a line, so this never goes below it
+            start = data.rfind(b'\n', 0, mid) + 1
+            end = data.find(b'\n', start)
+            if end == -1:
+                end = len(data)
+            line = data[start:end]
+            if line == target:
+                return True
+            if line < target:
+                lo = end + 1
+            else:
+                hi = start
+        return False
+
+
+class MappedCommonPasswordValidator(object):
+    """Reject passwords found in a memory-mapped common-password list."""
+
+    def __init__(self, password_list_path=DEFAULT_PASSWORD_LIST_PATH):
+        self.passwords = SortedPasswordList(password_list_path)
+
+    def validate(self, password, user=None):
+        if normalize(password) in self.passwords:
+            raise ValidationError(
+                _("This password is too common."),
+                code='password_too_common',
+            )
+
+    def get_help_text(self):
+        return _("Your password can't be a commonly used password.")
+
+
+class PasswordPolicy(object):
+    """The site's rules for new passwords."""
+    MIN_LENGTH = 14
+    LOWERCASE = re.compile(r'[a-z]')
+    UPPERCASE = re.compile(r'[A-Z]')
+    DIGIT = re.compile(r'\d')
+    SPECIAL = re.compile(r'[@#$]')
+
+    def __init__(self, min_length=MIN_LENGTH):
+        self.min_length = min_length
+
+    def validate(self, password, user, old_password=None):
+        """Raise ValidationError for the first rule `password` breaks."""
+        # Must not be the same as the current password
+        if password == old_password:
+            raise ValidationError(
+                "New password cannot match the old password.")
+
+        # Must use both uppercase and lowercase letters
+        if not self.LOWERCASE.search(password) or \
+          not self.UPPERCASE.search(password):
+            raise ValidationError("The new password must use both "
+                "uppercase and lowercase letters.")
+
+        # Minimum password length
+        if len(password) < self.min_length:
+            raise ValidationError(
+                "The new password must be at least %d characters long." %
+                self.min_length
+            )
+
+        # Must include of one or more numerical digits
+        if not self.DIGIT.search(password):
+            raise ValidationError("The new password must include one or "
+                "more numerical digits.")
+
+        # Must include of special characters, such as @, #, $
+        if not self.SPECIAL.search(password):
+            raise ValidationError("The new password must include the at "
+                "least one of the following characters: @, #, or $.")
+
+        # Cannot contain the username or parts of the user's full name
+        lowered = password.lower()
+        if any(part.lower() in lowered
+                for part in (user.first_name, user.last_name, user.username)):
+            raise ValidationError("The new password cannot contain your "
+                "username ({}) or parts of your full name ({} {}).".format(
+                    user.username, user.first_name, user.last_name))
@@ -0,0 +1,103 @@
+"""Token index used by the admin user search.
+
+Every user is indexed as a set of normalized words taken from their email,
+names, username, location and country. A search term matches a user when
+each of its words is a prefix of one of the user's tokens. Prefix lookups
+are range scans on the (token, user) index, so a search never has to read
+the whole user table.
+"""
+import re
+import sys
+import unicodedata
+
+from django.db import transaction
+
+TOKEN_MAX_LENGTH = 100
+WORD_SPLIT = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize(text):
+    """Lowercase text and strip accents from it."""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Return the normalized words of some text."""
+    if not text:
+        return []
+    return [word[:TOKEN_MAX_LENGTH]
+            for word in WORD_SPLIT.split(normalize(text)) if word]
+
+
+def user_tokens(user, profile=None):
+    """Return the set of tokens a user should be found by."""
+    tokens = set()
+    for value in (user.email, user.first_name, user.last_name,
+                  user.username):
+        tokens.update(tokenize(value))
+    if profile is not None:
+        tokens.update(tokenize(profile.location))
+        if profile.country:
+            tokens.update(tokenize(profile.country.code))
+            tokens.update(tokenize(profile.country.name))
+    return tokens
+
+
+def index_users(pairs, token_model=None):
+    """Replace the tokens of each (user, profile) pair in `pairs`.
+
+    Migrations pass their historical UserSearchToken as `token_model`.
+    """
+    from .models import UserSearchToken
+
+    UserSearchToken = token_model or UserSearchToken
+    pairs = list(pairs)
+    with transaction.atomic():
+        UserSearchToken.objects.filter(
+            user_id__in=[user.pk for user, profile in pairs]).delete()
+        UserSearchToken.objects.bulk_create([
+            UserSearchToken(user_id=user.pk, token=token)
+            for user, profile in pairs
+            for token in user_tokens(user, profile)
+        ])
+
+
+def index_user(user):
+    """Reindex a single user, with their profile when it exists."""
+    from .models import UserProfile
+
+    try:
+        profile = user.userprofile
+    except UserProfile.DoesNotExist:
+        profile = None
+    index_users([(user, profile)])
+
+
+def search_users(queryset, term):
+    """Filter a user queryset down to users matching every word of
+    `term`."""
+    from .models import UserSearchToken
+
+    words = tokenize(term)
+    if not words:
+        # Nothing to search for, e.g. only punctuation
+        return queryset.none()
+    for word in words:
+        # A range rather than startswith, which SQLite cannot answer from
+        # an index.
+        matches = UserSearchToken.objects.filter(token__gte=word)
+        upper = prefix_upper_bound(word)
+        if upper is not None:
+            matches = matches.filter(token__lt=upper)
+        queryset = queryset.filter(pk__in=matches.values('user_id'))
+    return queryset
+
+
+def prefix_upper_bound(prefix):
+    """Return the first string after every string starting with `prefix`,
+    or None if there is none."""
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
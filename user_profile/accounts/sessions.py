@@ -0,0 +1,85 @@
+"""Cached, database-backed sessions indexed by user.
+
+SessionStore reads sessions from the cache and writes them through to the
+UserSession table, which records the signed-in user of each session. That
+index lets delete_user_sessions() sign a user out everywhere with an
+indexed delete. Expired rows are removed a batch at a time: one batch per
+SESSION_CLEANUP_INTERVAL seconds, during a session save, so the table
+never needs a full `clearsessions` sweep.
+
+Sessions stay cached for their whole age, so SESSION_CACHE_ALIAS must
+name a cache shared by all processes: a session deleted by one process is
+otherwise still accepted by the others.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.cached_db import (
+    SessionStore as CachedDBStore
+)
+from django.core.cache import caches
+from django.utils import timezone
+
+KEY_PREFIX = 'accounts.sessions'
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = KEY_PREFIX
+    # When this process last removed a batch of expired sessions
+    last_cleanup = time.time()
+
+    @classmethod
+    def get_model_class(cls):
+        from .models import UserSession
+        return UserSession
+
+    def create_model_instance(self, data):
+        obj = super(SessionStore, self).create_model_instance(data)
+        try:
+            obj.user_id = int(data.get(SESSION_KEY))
+        except (TypeError, ValueError):
+            obj.user_id = None
+        return obj
+
+    def save(self, must_create=False):
+        super(SessionStore, self).save(must_create)
+        interval = getattr(settings, 'SESSION_CLEANUP_INTERVAL', 60)
+        if interval and time.time() - SessionStore.last_cleanup >= interval:
+            SessionStore.last_cleanup = time.time()
+            self.expire_batch()
+
+    @classmethod
+    def expire_batch(cls, batch_size=None):
+        """Delete up to `batch_size` expired sessions; returns how many."""
+        batch_size = batch_size or getattr(settings,
+            'SESSION_CLEANUP_BATCH_SIZE', 500)
+        model = cls.get_model_class()
+        keys = list(model.objects.filter(expire_date__lt=timezone.now())
+            .values_list('pk', flat=True)[:batch_size])
+        if keys:
+            model.objects.filter(pk__in=keys).delete()
+        return len(keys)
+
+    @classmethod
+    def clear_expired(cls):
+        while cls.expire_batch():
+            pass
+
+
+def delete_user_sessions(user_id, keep=None):
+    """Delete every session of a user except the one keyed `keep`.
+
+    Returns the number of sessions deleted.
+    """
+    from .models import UserSession
+
+    sessions = UserSession.objects.filter(user_id=user_id).exclude(
+        pk=keep or '')
+    keys = list(sessions.values_list('pk', flat=True))
+    if not keys:
+        return 0
+    caches[settings.SESSION_CACHE_ALIAS].delete_many(
+        [KEY_PREFIX + key for key in keys])
+    UserSession.objects.filter(pk__in=keys).delete()
+    return len(keys)
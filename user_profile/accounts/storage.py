@@ -0,0 +1,19 @@
+from django.contrib.staticfiles.storage import StaticFilesStorage
+from django.utils.functional import cached_property
+
+from . import assets
+
+
+class BundleStaticFilesStorage(StaticFilesStorage):
+    """Static files storage serving asset bundles under their hashed names.
+
+    `{% static 'bundles/site.css' %}` resolves through the manifest written
+    by `manage.py build_assets`; every other file keeps its own name.
+    """
+    @cached_property
+    def bundles(self):
+        return assets.load_manifest()
+
+    def url(self, name):
+        return super(BundleStaticFilesStorage, self).url(
+            self.bundles.get(name, name))
@@ -0,0 +1,224 @@
+"""Database-backed queue for work that should not hold up a request.
+
+Functions registered with @task are queued with enqueue() and run later by
+`manage.py run_workers`; nothing outside the database is needed. Jobs are
+claimed highest priority first, oldest first. A job whose task raises is
+retried with exponential back-off until it has used max_attempts, and is
+then kept as failed with its traceback. Each job records when it ran and
+how long it took; task_stats() sums that up per task.
+
+With TASKS_EAGER set, enqueue() runs the task immediately instead, which
+is what the tests use.
+"""
+import json
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Avg, Count, F, Max
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+registry = {}
+
+
+class Task(object):
+    """A registered function and the options its jobs run with."""
+
+    def __init__(self, func, name, priority=0, max_attempts=3,
+                 retry_delay=30, batch_size=1):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def run(self, payloads):
+        """Run the task for a list of payloads.
+
+        Tasks with a batch_size above 1 are called once with the whole
+        list; others once per payload, as keyword arguments.
+        """
+        if self.batch_size > 1:
+            self.func(payloads)
+        else:
+            for payload in payloads:
+                self.func(**payload)
+
+    def delay(self, **payload):
+        return enqueue(self.name, payload)
+
+
+def task(name=None, **options):
+    """Register a function as a task, under `name` or its own name.
+
+    Options are those of Task: priority, max_attempts, retry_delay (in
+    seconds, doubled after each failure) and batch_size.
+    """
+    def register(func):
+        registered = Task(func, name or func.__name__, **options)
+        registry[registered.name] = registered
+        return registered
+    return register
+
+
+def enqueue(name, payload=None, priority=None, delay=0):
+    """Queue a job for the task `name`; returns the Job, or None when
+    TASKS_EAGER ran it immediately."""
+    from .models import Job
+
+    registered = registry[name]
+    payload = payload or {}
+    if getattr(settings, 'TASKS_EAGER', False):
+        registered.run([payload])
+        return None
+    return Job.objects.create(
+        name=name,
+        payload=json.dumps(payload),
+        priority=registered.priority if priority is None else priority,
+        max_attempts=registered.max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def worker_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def claim(worker, limit=None):
+    """Mark the next due jobs as running for `worker` and return them.
+
+    The jobs share one task; up to its batch_size are claimed together.
+    The claim is a conditional UPDATE, so two workers never get the same
+    job.
+    """
+    from .models import Job
+
+    due = Job.objects.filter(status=QUEUED, run_at__lte=timezone.now())
+    first = due.order_by('-priority', 'run_at', 'pk').first()
+    if first is None:
+        return []
+    registered = registry.get(first.name)
+    batch_size = registered.batch_size if registered else 1
+    if limit is not None:
+        batch_size = min(batch_size, limit)
+    ids = list(due.filter(name=first.name, priority=first.priority)
+        .order_by('run_at', 'pk').values_list('pk', flat=True)[:batch_size])
+    now = timezone.now()
+    Job.objects.filter(pk__in=ids, status=QUEUED).update(status=RUNNING,
+        locked_by=worker, started_at=now, attempts=F('attempts') + 1)
+    return list(Job.objects.filter(pk__in=ids, status=RUNNING,
+        locked_by=worker).order_by('pk'))
+
+
+def run_jobs(jobs):
+    """Run a claimed batch of jobs and record the outcome of each."""
+    from .models import Job
+
+    registered = registry.get(jobs[0].name)
+    started = time.perf_counter()
+    try:
+        if registered is None:
+            raise LookupError("No task named {!r}".format(jobs[0].name))
+        registered.run([job.payload_data for job in jobs])
+    except Exception:
+        error = traceback.format_exc()
+        duration = time.perf_counter() - started
+        logger.exception("Task %s failed for job(s) %s", jobs[0].name,
+            ', '.join(str(job.pk) for job in jobs))
+        for job in jobs:
+            retry = job.attempts < job.max_attempts and registered is not None
+            job.status = QUEUED if retry else FAILED
+            if retry:
+                job.run_at = timezone.now() + timedelta(
+                    seconds=registered.retry_delay * 2 ** (job.attempts - 1))
+            job.last_error = error
+            job.duration = duration
+            job.finished_at = timezone.now()
+            job.locked_by = ''
+            job.save(update_fields=['status', 'run_at', 'last_error',
+                'duration', 'finished_at', 'locked_by'])
+        return False
+
+    duration = time.perf_counter() - started
+    Job.objects.filter(pk__in=[job.pk for job in jobs]).update(status=DONE,
+        duration=duration / len(jobs), finished_at=timezone.now(),
+        locked_by='')
+    logger.info("Ran %d %s job(s) in %.1fms", len(jobs), jobs[0].name,
+        duration * 1000)
+    return True
+
+
+def run_pending(worker=None, limit=None):
+    """Run due jobs until none are left (or `limit` have run).
+
+    Returns the number of jobs run.
+    """
+    worker = worker or worker_name()
+    count = 0
+    while limit is None or count < limit:
+        jobs = claim(worker, None if limit is None else limit - count)
+        if not jobs:
+            break
+        run_jobs(jobs)
+        count += len(jobs)
+    return count
+
+
+def requeue_stale(timeout=None):
+    """Return jobs stuck as running, e.g. after a worker was killed, to
+    the queue. Returns how many were requeued.
+
+    Jobs that have used max_attempts are failed instead: one that kills
+    its worker (running out of memory, say) would otherwise be retried
+    forever.
+    """
+    from .models import Job
+
+    if timeout is None:
+        timeout = getattr(settings, 'TASK_LOCK_TIMEOUT', 600)
+    now = timezone.now()
+    stale = Job.objects.filter(status=RUNNING,
+        started_at__lt=now - timedelta(seconds=timeout))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=FAILED, locked_by='', finished_at=now,
+        last_error="The worker stopped while running this job.")
+    if failed:
+        logger.error("Failed %d stale job(s) that used all their attempts",
+            failed)
+    return stale.update(status=QUEUED, locked_by='')
+
+
+def task_stats():
+    """Return {task name: {status: job count, 'mean_ms', 'max_ms'}}.
+
+    Timings are over the jobs that have finished.
+    """
+    from .models import Job
+
+    stats = {}
+    rows = Job.objects.values('name', 'status').annotate(count=Count('pk'),
+        mean=Avg('duration'), longest=Max('duration')).order_by()
+    for row in rows:
+        entry = stats.setdefault(row['name'], {
+            QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0,
+            'mean_ms': None, 'max_ms': None})
+        entry[row['status']] = row['count']
+        if row['status'] == DONE and row['mean'] is not None:
+            entry['mean_ms'] = row['mean'] * 1000
+            entry['max_ms'] = row['longest'] * 1000
+    return stats
@@ -0,0 +1,46 @@
+"""Django template backend that keeps count of time spent rendering.
+
+Like the hasher counters, totals are cumulative per thread; callers take
+the difference between two readings of get_render_time(). Templates
+rendered from inside another template (bootstrap3's field templates, for
+instance) are counted as part of the outer render only.
+"""
+import threading
+import time
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+_local = threading.local()
+
+
+def get_render_time():
+    """Return the seconds spent rendering templates in this thread."""
+    return getattr(_local, 'seconds', 0.0)
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        depth = getattr(_local, 'depth', 0)
+        _local.depth = depth + 1
+        started = time.time()
+        try:
+            return super(TimedTemplate, self).render(context, request)
+        finally:
+            _local.depth = depth
+            if not depth:
+                _local.seconds = get_render_time() + time.time() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates returning templates that time their rendering."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
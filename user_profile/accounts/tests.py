@@ -1,11 +1,57 @@
-from django.test import TestCase
+import asyncore
+import json
+import os
+import shutil
+import smtpd
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import SkipFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.test.client import RequestFactory
+from django.utils import timezone
+from django.utils.http import http_date
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.core.urlresolvers import reverse
 from django.contrib.auth import get_user_model
 from django.db.models.signals import post_save
 from django.contrib.auth.forms import AuthenticationForm
 
-from accounts.models import User, UserProfile, create_user_profile
+from PIL import Image
+
+from accounts import (
+    assets, avatars, caching, exports, outbox, search, sessions, tasks,
+    throttling, uploadhandlers, writebehind
+)
+from accounts.admin import UserAdmin
+from accounts.middleware import BudgetExceeded
+from accounts.models import (
+    Job, OutboundEmail, User, UserProfile, UserSearchToken, UserSession,
+    create_user_profile
+)
+from accounts.pagination import CachedCountPaginator
+from accounts.passwords import (
+    MappedCommonPasswordValidator, SortedPasswordList
+)
+from user_profile.staticserver import Mount, StaticFilesApplication
+from user_profile.templatecache import warm_template_cache
+from user_profile.views import serve_media
+from accounts.uploadhandlers import BoundedTemporaryFileUploadHandler
+from accounts.validators import validate_avatar
+from accounts.widgets import CachedCountrySelectWidget
 from accounts.forms import * # import all forms
 
 user_create_form_data = {
@@ -27,6 +73,21 @@ user_create_form_data_incorrect = {
 }
 
 
+def setUpModule():
+    # File-based caches are shared with any server running from this
+    # checkout; give the tests their own
+    global cache_dir, cache_overrides
+    cache_dir = tempfile.mkdtemp()
+    cache_overrides = override_settings(
+        CACHES=caching.relocated_caches(cache_dir))
+    cache_overrides.enable()
+
+
+def tearDownModule():
+    cache_overrides.disable()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
 class TestDataMixin():
 
     @classmethod
@@ -137,6 +198,813 @@ class UserViewTests(TestDataMixin, TestCase):
         self.assertEqual(response.status_code, 302)
 
 
+class ProfileCacheTests(TestDataMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caching.get_user_cache().clear()
+        caching.reset_profile_cache_stats()
+        self.client.login(email='testclient@example.com', password='password')
+
+    def test_profile_fragment_is_cached(self):
+        self.client.get(reverse('accounts:profile'))
+        response = self.client.get(reverse('accounts:profile'))
+        self.assertContains(response, 'testclient@example.com')
+        self.assertEqual(caching.profile_cache_stats(),
+            {'hits': 1, 'misses': 1})
+
+    def test_profile_save_invalidates_fragment(self):
+        self.client.get(reverse('accounts:profile'))
+        profile = UserProfile.objects.get(user=self.user1)
+        profile.hobby = 'Surfing'
+        profile.save()
+        response = self.client.get(reverse('accounts:profile'))
+        self.assertContains(response, 'Surfing')
+        self.assertEqual(caching.profile_cache_stats(),
+            {'hits': 0, 'misses': 2})
+
+    def test_profile_saved_elsewhere_is_rendered_afresh(self):
+        self.client.get(reverse('accounts:profile'))
+        # As saved by another process: only the shared user cache is
+        # invalidated, this process's fragments are left alone
+        UserProfile.objects.filter(user=self.user1).update(hobby='Surfing',
+            updated_at=timezone.now())
+        caching.invalidate_user(self.user1.pk)
+        response = self.client.get(reverse('accounts:profile'))
+        self.assertContains(response, 'Surfing')
+
+
+class UserCacheTests(TestDataMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caching.get_user_cache().clear()
+        self.client.login(email='testclient@example.com', password='password')
+
+    def test_warm_profile_view_queries(self):
+        self.client.get(reverse('accounts:profile'))
+        # The session, user, profile and page all come from the cache
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('accounts:profile'))
+        self.assertContains(response, 'testclient@example.com')
+
+    def test_user_save_invalidates_cache(self):
+        self.client.get(reverse('accounts:profile'))
+        self.assertIsNotNone(caching.get_cached_user(self.user1.pk))
+        user = User.objects.get(pk=self.user1.pk)
+        user.first_name = 'Changed'
+        user.save()
+        self.assertIsNone(caching.get_cached_user(self.user1.pk))
+        response = self.client.get(reverse('accounts:profile'))
+        self.assertContains(response, 'Changed')
+
+    def test_user_cache_is_shared_between_processes(self):
+        self.assertNotIsInstance(caching.get_user_cache(), LocMemCache)
+
+    def test_deactivated_user_is_signed_out(self):
+        self.client.get(reverse('accounts:profile'))
+        user = User.objects.get(pk=self.user1.pk)
+        user.is_active = False
+        user.save()
+        response = self.client.get(reverse('accounts:profile'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_password_change_invalidates_cache(self):
+        self.client.get(reverse('accounts:profile'))
+        user = User.objects.get(pk=self.user1.pk)
+        user.set_password('changed')
+        user.save()
+        # The session hash no longer matches, so the session is flushed
+        response = self.client.get(reverse('accounts:profile'))
+        self.assertEqual(response.status_code, 302)
+
+
+class SessionStoreTests(TestDataMixin, TestCase):
+
+    def setUp(self):
+        self.cache = caches['sessions']
+        self.cache.clear()
+
+    def sign_in(self, client=None):
+        client = client or self.client
+        client.login(email='testclient@example.com', password='password')
+        return client.session.session_key
+
+    def test_session_indexed_by_user(self):
+        key = self.sign_in()
+        self.assertEqual(UserSession.objects.get(pk=key).user, self.user1)
+
+    def test_session_read_from_cache(self):
+        key = self.sign_in()
+        with self.assertNumQueries(0):
+            store = sessions.SessionStore(key)
+            self.assertEqual(store.get('_auth_user_id'), str(self.user1.pk))
+
+    def test_session_read_from_database_after_cache_miss(self):
+        key = self.sign_in()
+        self.cache.clear()
+        store = sessions.SessionStore(key)
+        self.assertEqual(store.get('_auth_user_id'), str(self.user1.pk))
+
+    def test_delete_user_sessions(self):
+        keep = self.sign_in()
+        other = self.sign_in(self.client_class())
+        self.assertEqual(
+            sessions.delete_user_sessions(self.user1.pk, keep=keep), 1)
+        self.assertEqual(
+            list(UserSession.objects.values_list('pk', flat=True)), [keep])
+        self.assertFalse(sessions.SessionStore().exists(other))
+        self.assertIsNone(self.cache.get(sessions.KEY_PREFIX + other))
+
+    def test_session_cache_is_shared_between_processes(self):
+        from django.conf import settings
+        self.assertNotIsInstance(caches[settings.SESSION_CACHE_ALIAS],
+            LocMemCache)
+
+    def test_tests_use_their_own_session_cache(self):
+        from django.conf import settings
+        self.assertTrue(settings.CACHES['sessions']['LOCATION'].startswith(
+            cache_dir))
+
+    def test_password_change_signs_out_other_sessions(self):
+        self.sign_in()
+        other_client = self.client_class()
+        self.sign_in(other_client)
+        response = self.client.post(reverse('accounts:change_password'), {
+            'old_password': 'password',
+            'new_password1': 'Abcdefghijklm1$',
+            'new_password2': 'Abcdefghijklm1$'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(UserSession.objects.count(), 1)
+        response = self.client.get(reverse('accounts:profile'))
+        self.assertEqual(response.status_code, 200)
+        response = other_client.get(reverse('accounts:profile'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_expire_batch(self):
+        expired = timezone.now() - timezone.timedelta(days=1)
+        UserSession.objects.bulk_create([
+            UserSession(session_key='expired{}'.format(i), session_data='',
+                expire_date=expired)
+            for i in range(5)
+        ])
+        key = self.sign_in()
+        self.assertEqual(sessions.SessionStore.expire_batch(batch_size=3), 3)
+        self.assertEqual(UserSession.objects.count(), 3)
+        sessions.SessionStore.clear_expired()
+        self.assertEqual(
+            list(UserSession.objects.values_list('pk', flat=True)), [key])
+
+    @override_settings(SESSION_CLEANUP_INTERVAL=1)
+    def test_save_removes_expired_sessions(self):
+        UserSession.objects.create(session_key='expired',
+            session_data='', expire_date=timezone.now() - timezone.timedelta(
+                days=1))
+        with mock.patch.object(sessions.SessionStore, 'last_cleanup', 0):
+            key = self.sign_in()
+        self.assertEqual(
+            list(UserSession.objects.values_list('pk', flat=True)), [key])
+
+
+class WriteBehindTests(TestCase):
+
+    def setUp(self):
+        writebehind.last_logins.flush()
+        self.users = [
+            User.objects.create_user(first_name='Write', last_name='Behind',
+                email='wb{}@example.com'.format(i), password='password')
+            for i in range(3)
+        ]
+        self.buffer = writebehind.WriteBehindBuffer('accounts.User',
+            ['last_login'])
+
+    def last_login(self, user):
+        return User.objects.values_list('last_login', flat=True).get(
+            pk=user.pk)
+
+    def test_sign_in_buffers_last_login(self):
+        self.client.login(email='wb0@example.com', password='password')
+        self.assertIsNone(self.last_login(self.users[0]))
+        self.assertEqual(writebehind.last_logins.flush(), 1)
+        self.assertIsNotNone(self.last_login(self.users[0]))
+
+    def test_flush_is_one_update(self):
+        now = timezone.now()
+        for i, user in enumerate(self.users):
+            self.buffer.record(user.pk,
+                last_login=now - timezone.timedelta(days=i))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.buffer.flush(), 3)
+        for i, user in enumerate(self.users):
+            self.assertEqual(self.last_login(user),
+                now - timezone.timedelta(days=i))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.buffer.flush(), 0)
+
+    def test_repeated_writes_coalesce(self):
+        first = timezone.now() - timezone.timedelta(minutes=1)
+        last = timezone.now()
+        self.buffer.record(self.users[0].pk, last_login=first)
+        self.buffer.record(self.users[0].pk, last_login=last)
+        self.assertEqual(self.buffer.stats()['coalesced'], 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.last_login(self.users[0]), last)
+        self.assertEqual(self.buffer.stats(), {'recorded': 2, 'coalesced': 1,
+            'written': 1, 'flushes': 1, 'pending': 0})
+
+    @override_settings(WRITE_BEHIND_BATCH_SIZE=2)
+    def test_flush_when_batch_is_full(self):
+        self.buffer.record(self.users[0].pk, last_login=timezone.now())
+        self.assertEqual(self.buffer.stats()['pending'], 1)
+        self.buffer.record(self.users[1].pk, last_login=timezone.now())
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+        self.assertIsNotNone(self.last_login(self.users[1]))
+
+    @override_settings(WRITE_BEHIND_INTERVAL=0)
+    def test_flush_when_interval_has_passed(self):
+        self.buffer.record(self.users[0].pk, last_login=timezone.now())
+        self.assertEqual(self.buffer.stats()['flushes'], 1)
+        self.assertIsNotNone(self.last_login(self.users[0]))
+
+    @override_settings(WRITE_BEHIND_INTERVAL=0)
+    def test_failed_flush_keeps_values(self):
+        from django.db import OperationalError
+        with mock.patch('django.db.models.query.QuerySet.update',
+                side_effect=OperationalError('database is locked')), \
+                self.assertLogs('accounts.writebehind', 'ERROR'):
+            self.buffer.record(self.users[0].pk, last_login=timezone.now())
+        self.assertEqual(self.buffer.stats()['pending'], 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertIsNotNone(self.last_login(self.users[0]))
+
+    @override_settings(WRITE_BEHIND_INTERVAL=0.05)
+    def test_timer_flushes_without_further_records(self):
+        flushed = threading.Event()
+
+        def flush():
+            # The rows are not committed, so the timer's thread cannot
+            # write them; take the values as flush() would
+            self.buffer.pending = {}
+            flushed.set()
+
+        self.buffer.start_timer()
+        with mock.patch.object(self.buffer, 'flush', side_effect=flush):
+            self.buffer.record(self.users[0].pk, last_login=timezone.now())
+            self.assertTrue(flushed.wait(5))
+
+    def test_values_from_another_database_are_dropped(self):
+        self.buffer.record(self.users[0].pk, last_login=timezone.now())
+        self.buffer.database = 'another.sqlite3'
+        with self.assertLogs('accounts.writebehind', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertIsNone(self.last_login(self.users[0]))
+
+
+class ConditionalGetTests(TestDataMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caching.get_user_cache().clear()
+        self.client.login(email='testclient@example.com', password='password')
+
+    def test_profile_not_modified(self):
+        response = self.client.get(reverse('accounts:profile'))
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        response = self.client.get(reverse('accounts:profile'),
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        profile = UserProfile.objects.get(user=self.user1)
+        profile.hobby = 'Surfing'
+        profile.save()
+        response = self.client.get(reverse('accounts:profile'),
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_profile_revalidated_after_deploy(self):
+        etag = self.client.get(reverse('accounts:profile'))['ETag']
+        deployed = ('0123456789ab', timezone.now())
+        with mock.patch.object(caching, 'deploy_version',
+                return_value=deployed):
+            response = self.client.get(reverse('accounts:profile'),
+                HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(deployed[0], response['ETag'])
+        self.assertEqual(response['Last-Modified'], http_date(
+            deployed[1].timestamp()))
+
+    def test_profile_with_messages_is_not_cached(self):
+        response = self.client.get(reverse('accounts:profile'))
+        etag = response['ETag']
+        response = self.client.post(reverse('accounts:change_password'), {
+            'old_password': 'password',
+            'new_password1': 'Abu$edSurfer17!',
+            'new_password2': 'Abu$edSurfer17!'
+        })
+        response = self.client.get(reverse('accounts:profile'),
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Your password has been updated!')
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_directory_api_not_modified(self):
+        response = self.client.get(reverse('accounts:directory_api'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        response = self.client.get(reverse('accounts:directory_api'),
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_media_not_modified(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with open(os.path.join(media_root, 'avatar.png'), 'wb') as f:
+            f.write(b'image')
+        request = RequestFactory().get('/media/avatar.png')
+        response = serve_media(request, 'avatar.png', media_root)
+        self.assertEqual(response.status_code, 200)
+        request = RequestFactory().get('/media/avatar.png',
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        response = serve_media(request, 'avatar.png', media_root)
+        self.assertEqual(response.status_code, 304)
+
+
+class PasswordHashingTests(TestDataMixin, TestCase):
+
+    def test_sign_up_hashes_once(self):
+        response = self.client.post(reverse('accounts:sign_up'), {
+            'first_name': 'Brian',
+            'last_name': 'Weber',
+            'email': 'brianweber2@gmail.com',
+            'verify_email': 'brianweber2@gmail.com',
+            'password1': 'surfing17',
+            'password2': 'surfing17'
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['X-Password-Hasher-Calls'], '1')
+        self.assertIn('_auth_user_id', self.client.session)
+
+    def test_change_password_hashes_twice(self):
+        # Once to check the old password and once to set the new one
+        self.client.login(email='testclient@example.com', password='password')
+        response = self.client.post(reverse('accounts:change_password'), {
+            'old_password': 'password',
+            'new_password1': 'Abu$edSurfer17!',
+            'new_password2': 'Abu$edSurfer17!'
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['X-Password-Hasher-Calls'], '2')
+
+
+@override_settings(LOGIN_THROTTLE_RATES={'ip': (5, 60), 'email': (2, 60)})
+class SignInThrottleTests(TestDataMixin, TestCase):
+
+    def setUp(self):
+        self.cache = throttling.get_cache()
+        self.cache.clear()
+
+    def sign_in(self, email, password='wrong'):
+        return self.client.post(reverse('accounts:sign_in'),
+            {'username': email, 'password': password})
+
+    def test_throttled_by_email(self):
+        self.assertEqual(self.sign_in('testclient@example.com').status_code,
+            200)
+        self.assertEqual(self.sign_in('testclient@example.com').status_code,
+            200)
+        response = self.sign_in('testclient@example.com', 'password')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['X-Password-Hasher-Calls'], '0')
+        self.assertNotIn('_auth_user_id', self.client.session)
+        self.assertEqual(throttling.rejection_counts(),
+            {'ip': 0, 'email': 1})
+
+    def test_throttled_by_ip(self):
+        for i in range(5):
+            self.sign_in('user{}@example.com'.format(i))
+        self.assertEqual(self.sign_in('other@example.com').status_code, 429)
+        self.assertEqual(throttling.rejection_counts(),
+            {'ip': 1, 'email': 0})
+
+    def test_sign_in_allowed(self):
+        response = self.sign_in('testclient@example.com', 'password')
+        self.assertEqual(response.status_code, 302)
+
+    def test_token_bucket_refills(self):
+        bucket = throttling.TokenBucket('bucket', 1, 60)
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        tokens, updated = self.cache.get('bucket')
+        self.cache.set('bucket', (tokens, updated - 60))
+        self.assertTrue(bucket.consume())
+
+    def test_throttle_cache_is_shared_between_processes(self):
+        self.assertNotIsInstance(self.cache, LocMemCache)
+
+    @override_settings(TRUSTED_PROXIES=['10.0.0.0/8'])
+    def test_client_ip_behind_trusted_proxy(self):
+        factory = RequestFactory()
+        request = factory.get('/', REMOTE_ADDR='10.0.0.2',
+            HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.9, 10.0.0.1')
+        self.assertEqual(throttling.get_client_ip(request), '203.0.113.9')
+        # Only a trusted proxy may say who the client is
+        request = factory.get('/', REMOTE_ADDR='198.51.100.7',
+            HTTP_X_FORWARDED_FOR='203.0.113.9')
+        self.assertEqual(throttling.get_client_ip(request), '198.51.100.7')
+        request = factory.get('/', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(throttling.get_client_ip(request), '10.0.0.2')
+
+    def test_concurrent_attempts_share_tokens(self):
+        start = threading.Barrier(20)
+        results = []
+
+        class SlowReadCache(object):
+            # Widens the gap between reading and writing a bucket
+            def __init__(self, cache):
+                self.cache = cache
+
+            def __getattr__(self, name):
+                return getattr(self.cache, name)
+
+            def get(self, *args, **kwargs):
+                value = self.cache.get(*args, **kwargs)
+                time.sleep(0.01)
+                return value
+
+        def attempt():
+            # Each thread has its own cache instance, as each process would
+            bucket = throttling.TokenBucket('bucket', 5, 3600,
+                cache=SlowReadCache(throttling.get_cache()))
+            start.wait()
+            results.append(bucket.consume())
+
+        threads = [threading.Thread(target=attempt) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 5)
+
+    def test_locked_bucket_refuses_attempts(self):
+        self.cache.add('bucket:lock', 1)
+        bucket = throttling.TokenBucket('bucket', 5, 60)
+        with mock.patch.object(throttling, 'LOCK_WAIT', 0):
+            self.assertFalse(bucket.consume())
+
+
+class ProfileDirectoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create_users([
+            {'first_name': 'Dir', 'last_name': 'User',
+             'email': 'dir{}@example.com'.format(i)}
+            for i in range(5)
+        ], workers=0)
+        UserProfile.objects.filter(user__email__in=[
+            'dir1@example.com', 'dir3@example.com']).update(country='NZ')
+        User.objects.filter(email='dir4@example.com').update(is_active=False)
+
+    def test_api_keyset_pagination(self):
+        url = reverse('accounts:directory_api')
+        usernames = []
+        with self.assertNumQueries(1):
+            page = self.client.get(url, {'limit': 3}).json()
+        usernames += [row['username'] for row in page['results']]
+        page = self.client.get(page['next']).json()
+        usernames += [row['username'] for row in page['results']]
+        self.assertIsNone(page['next'])
+        self.assertEqual(usernames, ['dir0', 'dir1', 'dir2', 'dir3'])
+        self.assertNotIn('email', page['results'][0])
+
+    def test_api_filters(self):
+        page = self.client.get(reverse('accounts:directory_api'),
+            {'country': 'nz'}).json()
+        self.assertEqual([row['username'] for row in page['results']],
+            ['dir1', 'dir3'])
+        self.assertEqual(page['results'][0]['country'], 'NZ')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('accounts:directory_api'),
+            {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_directory_view(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('accounts:directory'),
+                {'limit': 2})
+        self.assertContains(response, '@dir1')
+        self.assertNotContains(response, '@dir2')
+        self.assertContains(response, 'Next page')
+
+
+class StaticFilesApplicationTests(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.static_dir = os.path.join(self.root, 'static')
+        self.media_dir = os.path.join(self.root, 'media')
+        os.makedirs(os.path.join(self.static_dir, 'bundles'))
+        os.makedirs(self.media_dir)
+        self.css = b'body{color:red}' * 20
+        self.write('static/bundles/site.0123456789ab.css', self.css)
+        self.write('static/bundles/site.0123456789ab.css.gz', b'gzipped')
+        self.write('static/robots.txt', b'0123456789')
+        self.app = StaticFilesApplication(self.django_app, [
+            Mount('/static/', self.static_dir),
+            Mount('/media/', self.media_dir, dynamic=True),
+        ], max_age=60)
+
+    def write(self, name, content):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(content)
+
+    def django_app(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'django']
+
+    def get(self, path, method='GET', **headers):
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path}
+        environ.update(('HTTP_' + key, value)
+            for key, value in headers.items())
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = int(status.split()[0])
+            response['headers'] = dict(headers)
+        body = self.app(environ, start_response)
+        response['body'] = b''.join(body)
+        if hasattr(body, 'close'):
+            body.close()
+        return response
+
+    def test_precompressed_variant(self):
+        response = self.get('/static/bundles/site.0123456789ab.css',
+            ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['body'], b'gzipped')
+        self.assertEqual(response['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(response['headers']['Content-Type'], 'text/css')
+        self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['headers']['Cache-Control'],
+            'public, max-age=31536000, immutable')
+
+        response = self.get('/static/bundles/site.0123456789ab.css',
+            ACCEPT_ENCODING='gzip;q=0')
+        self.assertEqual(response['body'], self.css)
+        self.assertNotIn('Content-Encoding', response['headers'])
+
+    def test_each_encoding_has_its_own_etag(self):
+        path = '/static/bundles/site.0123456789ab.css'
+        gzip_etag = self.get(path, ACCEPT_ENCODING='gzip')['headers']['ETag']
+        identity = self.get(path)['headers']
+        self.assertNotEqual(gzip_etag, identity['ETag'])
+        self.assertEqual(identity['Vary'], 'Accept-Encoding')
+
+        response = self.get(path, ACCEPT_ENCODING='gzip',
+            IF_NONE_MATCH=gzip_etag)
+        self.assertEqual(response['status'], 304)
+        self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+        # The gzipped file's ETag does not validate the identity one
+        response = self.get(path, IF_NONE_MATCH=gzip_etag)
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(response['body'], self.css)
+        response = self.get(path, ACCEPT_ENCODING='gzip', RANGE='bytes=0-3',
+            IF_RANGE=identity['ETag'])
+        self.assertEqual(response['status'], 206)
+        self.assertEqual(response['headers']['ETag'], identity['ETag'])
+        self.assertEqual(response['body'], self.css[:4])
+
+    def test_unhashed_name_is_revalidated(self):
+        response = self.get('/static/robots.txt')
+        self.assertEqual(response['headers']['Cache-Control'],
+            'public, max-age=60')
+        self.assertNotIn('Vary', response['headers'])
+
+    def test_conditional_get(self):
+        etag = self.get('/static/robots.txt')['headers']['ETag']
+        response = self.get('/static/robots.txt', IF_NONE_MATCH=etag)
+        self.assertEqual(response['status'], 304)
+        self.assertEqual(response['body'], b'')
+
+    def test_range_requests(self):
+        response = self.get('/static/robots.txt', RANGE='bytes=2-4')
+        self.assertEqual(response['status'], 206)
+        self.assertEqual(response['body'], b'234')
+        self.assertEqual(response['headers']['Content-Range'],
+            'bytes 2-4/10')
+        self.assertEqual(
+            self.get('/static/robots.txt', RANGE='bytes=-3')['body'], b'789')
+        response = self.get('/static/robots.txt', RANGE='bytes=20-')
+        self.assertEqual(response['status'], 416)
+        self.assertEqual(response['headers']['Content-Range'], 'bytes */10')
+        # A stale If-Range gets the whole file
+        response = self.get('/static/robots.txt', RANGE='bytes=2-4',
+            IF_RANGE='"stale"')
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(response['body'], b'0123456789')
+
+    def test_media_added_after_startup(self):
+        self.assertEqual(self.get('/media/new.txt')['body'], b'django')
+        self.write('media/new.txt', b'uploaded')
+        self.assertEqual(self.get('/media/new.txt')['body'], b'uploaded')
+        self.assertEqual(
+            self.get('/media/../static/robots.txt')['body'], b'django')
+
+    def test_other_requests_reach_django(self):
+        self.assertEqual(self.get('/accounts/')['body'], b'django')
+        self.assertEqual(self.get('/static/robots.txt', method='POST')[
+            'body'], b'django')
+        self.assertEqual(self.get('/static/missing.css')['body'], b'django')
+
+
+class TemplateWarmupTests(TestCase):
+
+    def cached_templates(self):
+        from django.conf import settings
+        options = dict(settings.TEMPLATES[0]['OPTIONS'], loaders=[
+            ('django.template.loaders.cached.Loader', [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ]),
+        ])
+        return [dict(settings.TEMPLATES[0], APP_DIRS=False, OPTIONS=options)]
+
+    def test_warmup_fills_cached_loader(self):
+        from django.template import engines
+        with override_settings(TEMPLATES=self.cached_templates()):
+            count, elapsed = warm_template_cache()
+            loader = engines['django'].engine.template_loaders[0]
+            cached = set(loader.get_template_cache)
+        self.assertGreaterEqual(count, 15)
+        self.assertIn('layout.html', cached)
+        self.assertIn('accounts/profile.html', cached)
+        self.assertIn('bootstrap3/field_help_text_and_errors.html', cached)
+
+    def test_warmup_skipped_without_cached_loader(self):
+        self.assertEqual(warm_template_cache()[0], 0)
+
+
+class RequestMetricsTests(TestDataMixin, TestCase):
+
+    def test_server_timing_header(self):
+        self.client.login(email='testclient@example.com', password='password')
+        with self.assertLogs('accounts.middleware', 'INFO') as logs:
+            response = self.client.get(reverse('accounts:profile'))
+        self.assertRegex(response['Server-Timing'],
+            r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries", tpl;dur=[0-9.]+, '
+            r'hash;dur=[0-9.]+, total;dur=[0-9.]+$')
+        self.assertEqual(logs.records[-1].view, 'accounts:profile')
+        self.assertGreater(logs.records[-1].metrics['template_ms'], 0)
+        self.assertIn('view=accounts:profile', logs.output[-1])
+
+    def test_hashing_time(self):
+        with self.assertLogs('accounts.middleware', 'INFO') as logs:
+            self.client.post(reverse('accounts:sign_up'),
+                user_create_form_data)
+        record = [record for record in logs.records
+            if getattr(record, 'view', None) == 'accounts:sign_up'][0]
+        self.assertGreater(record.metrics['hashing_ms'], 0)
+
+    def test_queries_counted_without_query_log(self):
+        logged = len(connection.queries_log)
+        with self.assertLogs('accounts.middleware', 'INFO') as logs:
+            self.client.get(reverse('accounts:directory'))
+        self.assertEqual(logs.records[-1].metrics['queries'], 1)
+        self.assertFalse(connection.force_debug_cursor)
+        self.assertEqual(len(connection.queries_log), logged)
+
+    @override_settings(REQUEST_BUDGETS={'accounts:directory': {'queries': 0}})
+    def test_budget_logged(self):
+        with self.assertLogs('accounts.middleware', 'WARNING') as logs:
+            self.client.get(reverse('accounts:directory'))
+        self.assertEqual(logs.output, ['WARNING:accounts.middleware:'
+            'accounts:directory over budget: queries 1 > 0'])
+
+    @override_settings(
+        REQUEST_BUDGETS={'accounts:directory': {'queries': 0}},
+        REQUEST_BUDGET_ACTION='raise')
+    def test_budget_raises(self):
+        with self.assertRaises(BudgetExceeded):
+            self.client.get(reverse('accounts:directory'))
+
+
+class QueryCountTests(TestCase):
+    """Pin the number of queries each page makes, at several data sizes.
+
+    Counts must not grow with the number of users; a change here usually
+    means an N+1 query or a lost select_related().
+    """
+    SIZES = (0, 10, 40)
+    EXPECTED = {
+        'home': 0,
+        'sign_in': 0,
+        'sign_in POST': 8,
+        'sign_up': 0,
+        'sign_up POST': 17,
+        'profile': 2,
+        'edit_profile': 2,
+        'edit_profile POST': 3,
+        'change_password': 2,
+        'change_password POST': 11,
+        'change_password POST (signed in elsewhere)': 12,
+        'admin changelist': 4,
+        'edit_profile POST (email)': 11,
+    }
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(first_name='Admin',
+            last_name='User', email='admin@example.com', password='password')
+        self.user = User.objects.create_user(first_name='Query',
+            last_name='Count', email='query@example.com', password='password')
+        UserProfile.objects.filter(user=self.user).update(country='NZ',
+            dob=datetime(1990, 1, 1, tzinfo=timezone.utc),
+            bio='A profile with a biography.',
+            location='Auckland', fav_animal='Kiwi', hobby='Tramping')
+
+    def seed(self, size):
+        User.objects.bulk_create_users([
+            {'first_name': 'Seed', 'last_name': 'User',
+             'email': 'seed{}@example.com'.format(i)}
+            for i in range(User.objects.count(), size)
+        ], workers=0)
+
+    def count(self, method, url, data=None, user=None):
+        self.client.logout()
+        if user is not None:
+            self.client.login(email=user.email, password='password')
+        writebehind.last_logins.flush()
+        for each in caches.all():
+            each.clear()
+        with CaptureQueriesContext(connection) as queries:
+            getattr(self.client, method)(url, data or {})
+        return len(queries)
+
+    def measure(self, size):
+        profile_data = {
+            'dob': '1990-01-01', 'bio': 'An updated biography.',
+            'location': 'Auckland', 'country': 'NZ',
+            'fav_animal': 'Tui', 'hobby': 'Cycling {}'.format(size),
+        }
+        counts = {
+            'home': self.count('get', reverse('home')),
+            'sign_in': self.count('get', reverse('accounts:sign_in')),
+            'sign_in POST': self.count('post', reverse('accounts:sign_in'),
+                {'username': 'query@example.com', 'password': 'password'}),
+            'sign_up': self.count('get', reverse('accounts:sign_up')),
+            'sign_up POST': self.count('post', reverse('accounts:sign_up'),
+                dict(user_create_form_data,
+                    email='new{}@example.com'.format(size),
+                    verify_email='new{}@example.com'.format(size))),
+            'profile': self.count('get', reverse('accounts:profile'),
+                user=self.user),
+            'edit_profile': self.count('get',
+                reverse('accounts:edit_profile'), user=self.user),
+            'edit_profile POST': self.count('post',
+                reverse('accounts:edit_profile'), dict(profile_data,
+                    first_name='Query', last_name='Count',
+                    email='query@example.com',
+                    verify_email='query@example.com'), user=self.user),
+            'change_password': self.count('get',
+                reverse('accounts:change_password'), user=self.user),
+            'admin changelist': self.count('get',
+                reverse('admin:accounts_user_changelist'), user=self.admin),
+        }
+        # Last, as it changes the password used to log in above
+        counts['change_password POST'] = self.count('post',
+            reverse('accounts:change_password'), {
+                'old_password': 'password',
+                'new_password1': 'Abcdefghijklm1$',
+                'new_password2': 'Abcdefghijklm1$'}, user=self.user)
+        self.user.set_password('password')
+        self.user.save()
+        # Also signs the user out of the other session
+        self.client_class().login(email=self.user.email, password='password')
+        counts['change_password POST (signed in elsewhere)'] = self.count(
+            'post', reverse('accounts:change_password'), {
+                'old_password': 'password',
+                'new_password1': 'Abcdefghijklm1$',
+                'new_password2': 'Abcdefghijklm1$'}, user=self.user)
+        self.user.set_password('password')
+        self.user.save()
+        # Also queues the email_changed notification
+        moved = 'moved{}@example.com'.format(size)
+        counts['edit_profile POST (email)'] = self.count('post',
+            reverse('accounts:edit_profile'), dict(profile_data,
+                first_name='Query', last_name='Count', email=moved,
+                verify_email=moved), user=self.user)
+        User.objects.filter(pk=self.user.pk).update(
+            email='query@example.com')
+        return counts
+
+    @override_settings(REQUEST_BUDGET_ACTION='raise')
+    def test_query_counts_do_not_grow(self):
+        for size in self.SIZES:
+            self.seed(size)
+            with self.subTest(users=size):
+                self.assertEqual(self.measure(size), self.EXPECTED)
+
+
 #################################
 ########## Model Tests ##########
 #################################
@@ -189,6 +1057,842 @@ class UserModelTests(TestDataMixin, TestCase):
         self.assertEqual(user.is_staff, True)
 
 
+class ChangeTrackingTests(TestDataMixin, TestCase):
+
+    def setUp(self):
+        self.profile = UserProfile.objects.get(user=self.user1)
+
+    def test_unchanged_save_is_skipped(self):
+        user = User.objects.get(pk=self.user1.pk)
+        user.first_name = 'Test'
+        with self.assertNumQueries(0):
+            user.save()
+            self.profile.save()
+
+    def test_save_writes_changed_fields(self):
+        self.profile.hobby = 'Knitting'
+        self.assertEqual(self.profile.get_changed_fields(), ['hobby'])
+        with CaptureQueriesContext(connection) as queries:
+            self.profile.save()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"hobby"', queries[0]['sql'])
+        self.assertIn('"updated_at"', queries[0]['sql'])
+        self.assertNotIn('"bio"', queries[0]['sql'])
+        self.assertEqual(self.profile.get_changed_fields(), [])
+        self.assertEqual(
+            UserProfile.objects.get(pk=self.profile.pk).hobby, 'Knitting')
+
+    def test_explicit_update_fields_are_kept(self):
+        self.profile.hobby = 'Knitting'
+        self.profile.bio = 'Not saved'
+        self.profile.save(update_fields=['hobby'])
+        profile = UserProfile.objects.get(pk=self.profile.pk)
+        self.assertEqual(profile.hobby, 'Knitting')
+        self.assertIsNone(profile.bio)
+
+    def test_fields_left_out_of_update_fields_stay_changed(self):
+        self.profile.hobby = 'Knitting'
+        self.profile.bio = 'Saved later'
+        self.profile.save(update_fields=['hobby'])
+        self.assertEqual(self.profile.get_changed_fields(), ['bio'])
+        self.profile.save()
+        self.assertEqual(self.profile.get_changed_fields(), [])
+        profile = UserProfile.objects.get(pk=self.profile.pk)
+        self.assertEqual((profile.hobby, profile.bio),
+            ('Knitting', 'Saved later'))
+
+    def test_refresh_from_db_resets_changes(self):
+        UserProfile.objects.filter(pk=self.profile.pk).update(hobby='Rowing')
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.get_changed_fields(), [])
+
+    def test_unindexed_change_skips_search_index(self):
+        self.profile.hobby = 'Knitting'
+        with mock.patch('accounts.search.index_user') as index_user:
+            self.profile.save()
+        self.assertFalse(index_user.called)
+        self.profile.location = 'Dunedin'
+        with mock.patch('accounts.search.index_user') as index_user:
+            self.profile.save()
+        self.assertTrue(index_user.called)
+
+    def test_edit_without_new_avatar_skips_variants(self):
+        UserProfile.objects.filter(pk=self.profile.pk).update(
+            avatar='avatar_photos/existing.jpg')
+        self.client.login(email='testclient@example.com', password='password')
+        response = self.client.post(reverse('accounts:edit_profile'), {
+            'first_name': 'Test', 'last_name': 'Client',
+            'email': 'testclient@example.com',
+            'verify_email': 'testclient@example.com',
+            'dob': '1990-01-01', 'bio': 'A biography that is long enough.',
+            'location': 'Auckland', 'country': 'NZ',
+            'fav_animal': 'Kiwi', 'hobby': 'Tramping',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Job.objects.exists())
+        profile = UserProfile.objects.get(pk=self.profile.pk)
+        self.assertEqual(profile.avatar.name, 'avatar_photos/existing.jpg')
+        self.assertEqual(profile.hobby, 'Tramping')
+
+
+class UserBulkCreateTests(TestCase):
+
+    def test_bulk_create_users(self):
+        rows = [
+            {'first_name': 'Bulk', 'last_name': 'User', 'password': 'secret',
+             'email': 'bulk{}@example.com'.format(i)}
+            for i in range(5)
+        ]
+        totals = []
+        created = User.objects.bulk_create_users(rows, batch_size=2,
+            workers=0, callback=totals.append)
+        self.assertEqual(created, 5)
+        self.assertEqual(totals, [2, 4, 5])
+        self.assertEqual(UserProfile.objects.count(), 5)
+        user = User.objects.get(email='bulk3@example.com')
+        self.assertEqual(user.username, 'bulk3')
+        self.assertTrue(user.check_password('secret'))
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+
+    def test_bulk_create_users_blank_password(self):
+        User.objects.bulk_create_users([{'first_name': 'Bulk',
+            'last_name': 'User', 'email': 'bulk@example.com'}], workers=0)
+        user = User.objects.get(email='bulk@example.com')
+        self.assertFalse(user.has_usable_password())
+
+    def test_bulk_create_users_no_email(self):
+        with self.assertRaises(ValueError):
+            User.objects.bulk_create_users([{'first_name': 'Bulk',
+                'last_name': 'User', 'email': ''}], workers=0)
+
+
+###################################
+########## Command Tests ##########
+###################################
+class ImportUsersCommandTests(TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as f:
+            f.write('first_name,last_name,email,password\n')
+            for i in range(4):
+                f.write('Csv,User,csv{}@example.com,secret\n'.format(i))
+        self.addCleanup(os.remove, self.path)
+
+    def test_import_users(self):
+        out = StringIO()
+        call_command('import_users', self.path, batch_size=3, workers=0,
+            stdout=out)
+        self.assertEqual(User.objects.count(), 4)
+        self.assertEqual(UserProfile.objects.count(), 4)
+        self.assertIn('rows/sec', out.getvalue())
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+    def test_import_users_resumes_from_checkpoint(self):
+        with open(self.path + '.checkpoint', 'w') as f:
+            f.write('3')
+        call_command('import_users', self.path, workers=0, stdout=StringIO())
+        self.assertEqual(
+            list(User.objects.values_list('email', flat=True)),
+            ['csv3@example.com']
+        )
+
+    def test_import_users_resumes_after_unrecorded_batch(self):
+        # A crash after rows 1 and 2 were committed, before the checkpoint
+        # recorded them
+        User.objects.bulk_create_users([
+            {'first_name': 'Csv', 'last_name': 'User',
+             'email': 'csv{}@example.com'.format(i)}
+            for i in range(3)
+        ], workers=0)
+        with open(self.path + '.checkpoint', 'w') as f:
+            f.write('1')
+        out = StringIO()
+        call_command('import_users', self.path, batch_size=2, workers=0,
+            stdout=out)
+        self.assertIn('Skipped 2 rows', out.getvalue())
+        self.assertEqual(User.objects.count(), 4)
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+
+class PasswordListTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.source = os.path.join(self.directory, 'breached.txt')
+        with open(self.source, 'w', encoding='utf-8') as f:
+            f.write('Zebra\n  monkey \npassword\nmonkey\n\nçava\n')
+        self.output = os.path.join(self.directory, 'sorted.txt')
+        call_command('build_password_list', self.source, output=self.output,
+            stdout=StringIO())
+
+    def test_build_password_list(self):
+        with open(self.output, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'monkey\npassword\nzebra\nçava\n')
+
+    def test_sorted_list_lookup(self):
+        passwords = SortedPasswordList(self.output)
+        for password in ['monkey', 'password', 'zebra', 'çava']:
+            self.assertIn(password, passwords)
+        for password in ['', 'a', 'monke', 'monkeys', 'zzz', 'passwore']:
+            self.assertNotIn(password, passwords)
+
+    def test_shipped_list_matches_django(self):
+        import gzip
+        from django.contrib.auth.password_validation import (
+            CommonPasswordValidator
+        )
+        passwords = SortedPasswordList(
+            MappedCommonPasswordValidator().passwords.path)
+        with gzip.open(CommonPasswordValidator.DEFAULT_PASSWORD_LIST_PATH,
+                'rt') as f:
+            for line in f:
+                self.assertIn(line.strip(), passwords)
+
+    def test_validator(self):
+        validator = MappedCommonPasswordValidator(self.output)
+        with self.assertRaises(ValidationError) as raised:
+            validator.validate(' MONKEY')
+        self.assertEqual(raised.exception.code, 'password_too_common')
+        validator.validate('Abu$edSurfer17!')
+
+
+class BenchCommandTests(TestCase):
+
+    def test_percentile(self):
+        from accounts.management.commands.bench import percentile
+        ordered = list(range(1, 101))
+        self.assertEqual(percentile(ordered, 0.50), 50)
+        self.assertEqual(percentile(ordered, 0.95), 95)
+        self.assertEqual(percentile(ordered, 0.99), 99)
+        self.assertEqual(percentile([7], 0.99), 7)
+
+    def test_run_benchmarks(self):
+        from accounts.management.commands.bench import (
+            SCENARIOS, run_benchmarks
+        )
+        results = run_benchmarks(users=3, iterations=2, warmup=1)
+        self.assertEqual(sorted(results),
+            sorted(scenario.name for scenario in SCENARIOS))
+        for name, result in results.items():
+            self.assertEqual((name, result['errors']), (name, 0))
+            self.assertEqual(result['requests'], 2)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_avatar_variants_are_timed(self):
+        from accounts.management.commands.bench import run_benchmarks
+        run_benchmarks(users=3, iterations=2, warmup=1,
+            names=['profile_edit_avatar'])
+        # Every variant job was run inside the timed requests
+        self.assertTrue(Job.objects.filter(name='generate_avatar_variants',
+            status=tasks.DONE).exists())
+        self.assertFalse(Job.objects.exclude(status=tasks.DONE).exists())
+
+
+class StubSMTPServer(smtpd.SMTPServer):
+    """Local SMTP stand-in counting connections and messages."""
+
+    def __init__(self):
+        super(StubSMTPServer, self).__init__(('127.0.0.1', 0), None,
+            decode_data=False)
+        self.port = self.socket.getsockname()[1]
+        self.connections = 0
+        self.recipients = []
+        self.thread = threading.Thread(target=asyncore.loop,
+            kwargs={'timeout': 0.05, 'map': self._map})
+        self.thread.start()
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        super(StubSMTPServer, self).handle_accepted(conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.recipients.extend(rcpttos)
+
+    def stop(self):
+        for channel in list(self._map.values()):
+            channel.close()
+        self.thread.join()
+
+
+class OutboxTests(TestDataMixin, TestCase):
+
+    def test_sign_up_queues_welcome_email(self):
+        self.client.post(reverse('accounts:sign_up'), user_create_form_data)
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.kind, email.recipient, email.status),
+            ('welcome', 'testing@gmail.com', outbox.QUEUED))
+        self.assertEqual(mail.outbox, [])
+        tasks.run_pending()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Welcome to Circle, Test!')
+        email.refresh_from_db()
+        self.assertEqual(email.status, outbox.SENT)
+        self.assertIsNone(email.dedup_key)
+
+    def test_password_and_email_change_notifications(self):
+        self.client.login(email='testclient@example.com', password='password')
+        self.client.post(reverse('accounts:change_password'), {
+            'old_password': 'password',
+            'new_password1': 'Abu$edSurfer17!',
+            'new_password2': 'Abu$edSurfer17!'})
+        self.client.post(reverse('accounts:edit_profile'), {
+            'first_name': 'Test', 'last_name': 'Client',
+            'email': 'moved@example.com', 'verify_email': 'moved@example.com',
+            'dob': '1988-06-19', 'bio': 'This is my bio.',
+            'location': 'San Diego, CA', 'country': 'US',
+            'fav_animal': 'Dog', 'hobby': 'Surfing'})
+        tasks.run_pending()
+        self.assertEqual([(message.to, message.subject)
+            for message in mail.outbox], [
+            (['testclient@example.com'], 'Your Circle password was changed'),
+            (['testclient@example.com'],
+                'Your Circle email address was changed'),
+        ])
+        self.assertIn('to moved@example.com', mail.outbox[1].body)
+
+    def test_deduplicates_queued_email(self):
+        context = {'user': self.user1}
+        self.assertIsNotNone(outbox.queue_email('password_changed',
+            self.user1.email, context))
+        self.assertIsNone(outbox.queue_email('password_changed',
+            self.user1.email.upper(), context))
+        outbox.send_pending()
+        self.assertIsNotNone(outbox.queue_email('password_changed',
+            self.user1.email, context))
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(OUTBOX_RECIPIENT_RATE=(2, 3600))
+    def test_throttles_per_recipient(self):
+        for n in range(3):
+            outbox.queue_email('password_changed', self.user1.email,
+                {'user': self.user1}, dedup=n)
+        outbox.queue_email('welcome', 'other@example.com',
+            {'user': self.user1})
+        stats = outbox.send_pending(batch_size=2)
+        self.assertEqual((stats['sent'], stats['deferred']), (3, 1))
+        # The third email waits for the throttle period to pass
+        stats = outbox.send_pending()
+        self.assertEqual((stats['sent'], stats['deferred']), (0, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [
+            'other@example.com', self.user1.email, self.user1.email])
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_sends_are_retried(self):
+        from smtplib import SMTPException
+        outbox.queue_email('welcome', self.user1.email, {'user': self.user1})
+        connection = mail.get_connection()
+        with mock.patch.object(connection, 'send_messages',
+                side_effect=SMTPException('down')), \
+                self.assertLogs('accounts.outbox', 'ERROR'):
+            self.assertEqual(outbox.send_pending(connection)['failed'], 0)
+            OutboundEmail.objects.update(send_after=timezone.now())
+            self.assertEqual(outbox.send_pending(connection)['failed'], 1)
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (outbox.FAILED, 2))
+        self.assertIn('down', email.last_error)
+
+    def test_claimed_emails_are_not_sent_twice(self):
+        for n in range(3):
+            outbox.queue_email('welcome', 'user{}@example.com'.format(n),
+                {'user': self.user1})
+        # Another drain has claimed the first two
+        last_pk, claimed = outbox.claim('other-worker', 0, 2)
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(outbox.send_pending()['sent'], 1)
+        self.assertEqual(outbox.claim('third-worker', 0, 10), (None, []))
+        # Its worker died; once the claim times out the emails are requeued
+        OutboundEmail.objects.filter(status=outbox.SENDING).update(
+            claimed_at=timezone.now() - timezone.timedelta(hours=1))
+        self.assertEqual(outbox.send_pending()['sent'], 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+            ['user{}@example.com'.format(n) for n in range(3)])
+
+    def test_one_smtp_connection_per_drain(self):
+        server = StubSMTPServer()
+        self.addCleanup(server.stop)
+        for n in range(5):
+            outbox.queue_email('welcome', 'user{}@example.com'.format(n),
+                {'user': self.user1})
+        connection = mail.get_connection(
+            'django.core.mail.backends.smtp.EmailBackend',
+            host='127.0.0.1', port=server.port)
+        out = StringIO()
+        with override_settings(OUTBOX_BATCH_SIZE=2), \
+                mock.patch('accounts.management.commands.send_outbox.'
+                    'get_connection', return_value=connection):
+            call_command('send_outbox', stdout=out)
+        self.assertIn('Sent 5 email(s)', out.getvalue())
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(sorted(server.recipients),
+            ['user{}@example.com'.format(n) for n in range(5)])
+
+
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.register('tests.record', lambda **payload: self.calls.append(
+            payload))
+        self.register('tests.batch', self.calls.append, batch_size=3)
+
+        def fail(**payload):
+            raise RuntimeError('boom')
+        self.register('tests.fail', fail, max_attempts=2, retry_delay=60)
+
+    def register(self, name, func, **options):
+        tasks.task(name, **options)(func)
+        self.addCleanup(tasks.registry.pop, name)
+
+    def test_priority_order(self):
+        tasks.enqueue('tests.record', {'n': 1})
+        tasks.enqueue('tests.record', {'n': 2}, priority=5)
+        tasks.enqueue('tests.record', {'n': 3})
+        self.assertEqual(tasks.run_pending(), 3)
+        self.assertEqual(self.calls, [{'n': 2}, {'n': 1}, {'n': 3}])
+        self.assertEqual(Job.objects.filter(status=tasks.DONE).count(), 3)
+        stats = tasks.task_stats()['tests.record']
+        self.assertEqual(stats[tasks.DONE], 3)
+        self.assertIsNotNone(stats['mean_ms'])
+
+    def test_batching(self):
+        for n in range(4):
+            tasks.enqueue('tests.batch', {'n': n})
+        with self.assertNumQueries(4):
+            jobs = tasks.claim('worker')
+        self.assertEqual(len(jobs), 3)
+        tasks.run_jobs(jobs)
+        tasks.run_pending()
+        self.assertEqual(self.calls, [
+            [{'n': 0}, {'n': 1}, {'n': 2}], [{'n': 3}]])
+
+    def test_retries_then_fails(self):
+        job = tasks.enqueue('tests.fail')
+        with self.assertLogs('accounts.tasks', 'ERROR'):
+            tasks.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (tasks.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('accounts.tasks', 'ERROR'):
+            tasks.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (tasks.FAILED, 2))
+        self.assertEqual(tasks.run_pending(), 0)
+
+    def test_requeue_stale(self):
+        job = tasks.enqueue('tests.record')
+        Job.objects.filter(pk=job.pk).update(status=tasks.RUNNING,
+            started_at=timezone.now() - timezone.timedelta(hours=1))
+        self.assertEqual(tasks.requeue_stale(timeout=60), 1)
+        self.assertEqual(tasks.run_pending(), 1)
+
+    def test_stale_job_without_attempts_left_fails(self):
+        job = tasks.enqueue('tests.record')
+        Job.objects.filter(pk=job.pk).update(status=tasks.RUNNING,
+            attempts=job.max_attempts,
+            started_at=timezone.now() - timezone.timedelta(hours=1))
+        with self.assertLogs('accounts.tasks', 'ERROR'):
+            self.assertEqual(tasks.requeue_stale(timeout=60), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, tasks.FAILED)
+        self.assertEqual(tasks.run_pending(), 0)
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager(self):
+        self.assertIsNone(tasks.enqueue('tests.record', {'n': 1}))
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertFalse(Job.objects.exists())
+
+    def test_worker_requeues_stale_jobs_on_each_poll(self):
+        from accounts.management.commands.run_workers import work
+        job = tasks.enqueue('tests.record', {'n': 1})
+        Job.objects.filter(pk=job.pk).update(status=tasks.RUNNING,
+            started_at=timezone.now() - timezone.timedelta(hours=1))
+        with self.assertLogs('accounts.management.commands.run_workers',
+                'WARNING'):
+            work(poll_interval=1, once=True)
+        self.assertEqual(self.calls, [{'n': 1}])
+
+    def test_worker_survives_database_errors(self):
+        from django.db import OperationalError
+        from accounts.management.commands import run_workers
+        with mock.patch.object(tasks, 'run_pending', side_effect=[
+                    OperationalError('database is locked'),
+                    OperationalError('database is locked'), 0,
+                    KeyboardInterrupt]), \
+                mock.patch.object(run_workers.time, 'sleep') as sleep, \
+                self.assertLogs(run_workers.logger, 'ERROR'):
+            with self.assertRaises(KeyboardInterrupt):
+                run_workers.work(poll_interval=1, once=False)
+        self.assertEqual([call[0][0] for call in sleep.call_args_list],
+            [2, 4, 1])
+
+    def test_run_workers_command(self):
+        tasks.enqueue('tests.record', {'n': 1})
+        out = StringIO()
+        call_command('run_workers', processes=1, once=True, stdout=out)
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertIn('tests.record: 1 done, 0 failed, 0 queued',
+            out.getvalue())
+
+
+class AvatarVariantTests(TestDataMixin, TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root,
+            TASKS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_upload(self, size=(600, 400), fmt='JPEG'):
+        buf = BytesIO()
+        Image.new('RGB', size, (200, 30, 30)).save(buf, fmt)
+        return SimpleUploadedFile('photo.jpg', buf.getvalue())
+
+    def test_variants_generated_on_save(self):
+        profile = UserProfile.objects.get(user=self.user1)
+        profile.avatar = self.make_upload()
+        profile.save()
+
+        variants = profile.avatar_variants
+        self.assertTrue(variants.ready)
+        for size in avatars.AVATAR_SIZES:
+            for fmt in avatars.variant_formats():
+                name = avatars.variant_name(profile.avatar.name, size, fmt)
+                with default_storage.open(name) as f:
+                    image = Image.open(f)
+                    self.assertEqual(image.size, (size, size))
+                    self.assertEqual(image.format, fmt)
+        self.assertIn('256w', variants.jpeg_srcset)
+        self.assertTrue(variants.src.endswith('_128.jpg'))
+        html = caching.render_profile(User.objects.get(pk=self.user1.pk))
+        self.assertIn(variants.jpeg_srcset, html)
+
+    @override_settings(TASKS_EAGER=False)
+    def test_variants_generated_by_worker(self):
+        profile = UserProfile.objects.get(user=self.user1)
+        profile.avatar = self.make_upload()
+        profile.save()
+        self.assertFalse(profile.avatar_variants.ready)
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'generate_avatar_variants')
+        self.assertEqual(job.priority, 10)
+
+        self.assertEqual(tasks.run_pending(), 1)
+        profile = UserProfile.objects.get(user=self.user1)
+        self.assertTrue(profile.avatar_variants.ready)
+
+    def test_profile_without_avatar_has_no_variants(self):
+        profile = UserProfile.objects.get(user=self.user1)
+        self.assertIsNone(profile.avatar_variants)
+
+    def test_apply_orientation(self):
+        image = Image.new('RGB', (20, 10))
+        image._getexif = lambda: {avatars.EXIF_ORIENTATION: 6}
+        self.assertEqual(avatars.apply_orientation(image).size, (10, 20))
+
+
+class AvatarUploadTests(TestCase):
+
+    def make_upload(self, size=(40, 30), fmt='PNG'):
+        buf = BytesIO()
+        Image.new('RGB', size).save(buf, fmt)
+        return SimpleUploadedFile('photo', buf.getvalue())
+
+    def test_valid_avatar(self):
+        upload = self.make_upload()
+        validate_avatar(upload)
+        self.assertEqual(upload.tell(), 0)
+
+    @override_settings(FILE_UPLOAD_MAX_SIZE=10)
+    def test_avatar_too_large(self):
+        with self.assertRaises(ValidationError):
+            validate_avatar(self.make_upload())
+
+    @override_settings(AVATAR_MAX_PIXELS=1000)
+    def test_avatar_too_many_pixels(self):
+        with self.assertRaises(ValidationError):
+            validate_avatar(self.make_upload())
+
+    def test_avatar_format(self):
+        with self.assertRaises(ValidationError):
+            validate_avatar(self.make_upload(fmt='BMP'))
+        with self.assertRaises(ValidationError):
+            validate_avatar(SimpleUploadedFile('photo', b'not an image'))
+
+    @override_settings(FILE_UPLOAD_MAX_SIZE=8)
+    def test_upload_handler_skips_file_at_limit(self):
+        request = RequestFactory().post('/')
+        handler = BoundedTemporaryFileUploadHandler(request)
+        handler.new_file('avatar', 'photo.png', 'image/png', None)
+        handler.receive_data_chunk(b'12345', 0)
+        with self.assertRaises(SkipFile):
+            handler.receive_data_chunk(b'67890', 5)
+        self.assertEqual(uploadhandlers.too_large_uploads(request),
+            {'avatar'})
+
+    @override_settings(FILE_UPLOAD_MAX_SIZE=100)
+    def test_too_large_avatar_reported_by_form(self):
+        user = User.objects.create_user(first_name='Big', last_name='Photo',
+            email='big@example.com', password='password')
+        self.client.login(email='big@example.com', password='password')
+        response = self.client.post(reverse('accounts:edit_profile'), {
+            'first_name': 'Big', 'last_name': 'Photo',
+            'email': 'big@example.com', 'verify_email': 'big@example.com',
+            'dob': '1990-01-01', 'bio': 'A biography that is long enough.',
+            'location': 'Auckland', 'country': 'NZ',
+            'fav_animal': 'Kiwi', 'hobby': 'Tramping',
+            'avatar': self.make_upload(size=(400, 300)),
+        })
+        self.assertFormError(response, 'form2', 'avatar',
+            'Your photo must be smaller than 100\xa0bytes.')
+        self.assertFalse(UserProfile.objects.get(user=user).avatar)
+
+
+class UserSearchTests(TestDataMixin, TestCase):
+
+    def test_tokens_follow_saves(self):
+        profile = UserProfile.objects.get(user=self.user1)
+        profile.location = 'San Diego'
+        profile.country = 'US'
+        profile.save()
+        tokens = set(UserSearchToken.objects.filter(
+            user=self.user1).values_list('token', flat=True))
+        self.assertEqual(tokens, {'testclient', 'example', 'com', 'test',
+            'client', 'san', 'diego', 'us', 'united', 'states', 'of',
+            'america'})
+
+    def test_search_users(self):
+        User.objects.create_user(first_name='José', last_name='Álvarez',
+            email='jose@example.org', password='password')
+        users = User.objects.all()
+        self.assertEqual(
+            list(search.search_users(users, 'alv').values_list(
+                'email', flat=True)),
+            ['jose@example.org']
+        )
+        self.assertEqual(search.search_users(users, 'exam').count(), 2)
+        self.assertEqual(search.search_users(users, 'test exam').count(), 1)
+        self.assertEqual(search.search_users(users, 'nobody').count(), 0)
+
+    def test_migration_indexes_existing_users(self):
+        from django.apps import apps
+        from importlib import import_module
+        migration = import_module(
+            'accounts.migrations.0014_index_existing_users')
+        UserSearchToken.objects.all().delete()
+        migration.index_existing_users(apps, None)
+        self.assertEqual(
+            list(search.search_users(User.objects.all(), 'testclient')),
+            [self.user1])
+
+    def test_search_without_words_matches_nobody(self):
+        self.assertEqual(search.search_users(User.objects.all(), '!?').count(),
+            0)
+
+    def test_search_tokens_outside_the_bmp(self):
+        User.objects.create_user(first_name='\U00020000\U00020001',
+            last_name='Han', email='han@example.com', password='password')
+        self.assertEqual(
+            search.search_users(User.objects.all(), '\U00020000').get().email,
+            'han@example.com')
+        self.assertEqual(search.prefix_upper_bound('ab'), 'ac')
+        self.assertIsNone(search.prefix_upper_bound(chr(sys.maxunicode)))
+
+    def test_bulk_created_users_are_indexed(self):
+        User.objects.bulk_create_users([{'first_name': 'Bulk',
+            'last_name': 'Loaded', 'email': 'bulk@example.com'}], workers=0)
+        self.assertEqual(
+            search.search_users(User.objects.all(), 'loaded').get().email,
+            'bulk@example.com')
+
+    def test_admin_search(self):
+        User.objects.create_superuser(first_name='Admin', last_name='User',
+            email='admin@example.com', password='password')
+        self.client.login(email='admin@example.com', password='password')
+        response = self.client.get(
+            reverse('admin:accounts_user_changelist'), {'q': 'testcl'})
+        self.assertContains(response, 'testclient@example.com')
+        self.assertNotContains(response, '>admin@example.com<')
+
+    def test_rebuild_search_index(self):
+        UserSearchToken.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(
+            search.search_users(User.objects.all(), 'client').get(),
+            self.user1)
+
+
+class UserChangeListTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caching.get_user_cache().clear()
+        User.objects.create_superuser(first_name='Admin', last_name='User',
+            email='admin@example.com', password='password')
+        User.objects.bulk_create_users([
+            {'first_name': 'List', 'last_name': 'User',
+             'email': 'user{}@example.com'.format(i)}
+            for i in range(4)
+        ], workers=0)
+        self.client.login(email='admin@example.com', password='password')
+        self.url = reverse('admin:accounts_user_changelist')
+
+    def emails(self, response):
+        return [user.email for user in response.context['cl'].result_list]
+
+    @mock.patch.object(UserAdmin, 'list_per_page', 2)
+    def test_seek_pagination(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.emails(response),
+            ['admin@example.com', 'user0@example.com'])
+        next_url = response.context['cl'].next_page_url
+        self.assertEqual(next_url, '?after=user0%40example.com')
+
+        response = self.client.get(self.url + next_url)
+        self.assertEqual(self.emails(response),
+            ['user1@example.com', 'user2@example.com'])
+        response = self.client.get(
+            self.url + response.context['cl'].next_page_url)
+        self.assertEqual(self.emails(response), ['user3@example.com'])
+        self.assertIsNone(response.context['cl'].next_page_url)
+
+    @mock.patch.object(UserAdmin, 'list_per_page', 2)
+    def test_seek_ignored_when_sorting(self):
+        response = self.client.get(self.url,
+            {'after': 'user0@example.com', 'o': '-1'})
+        self.assertEqual(self.emails(response),
+            ['user3@example.com', 'user2@example.com'])
+        self.assertIsNone(response.context['cl'].next_page_url)
+
+    def test_cached_count(self):
+        self.assertEqual(CachedCountPaginator(User.objects.all(), 2).count, 5)
+        User.objects.create_user(first_name='New', last_name='User',
+            email='new@example.com')
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                CachedCountPaginator(User.objects.all(), 2).count, 5)
+        self.assertEqual(
+            CachedCountPaginator(User.objects.filter(is_staff=True), 2).count,
+            1)
+
+
+class ExportUsersTests(TestDataMixin, TestCase):
+
+    def setUp(self):
+        User.objects.bulk_create_users([
+            {'first_name': 'Export', 'last_name': 'User',
+             'email': 'export{}@example.com'.format(i)}
+            for i in range(3)
+        ], workers=0)
+
+    def test_export_jsonl_in_chunks(self):
+        with self.assertNumQueries(3):
+            lines = list(exports.export_users(User.objects.all(), 'jsonl',
+                chunk_size=2))
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['email'] for row in rows], [
+            'testclient@example.com', 'export0@example.com',
+            'export1@example.com', 'export2@example.com'])
+        self.assertEqual(list(rows[0]), exports.COLUMNS)
+
+    def test_export_users_command(self):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        User.objects.filter(email='export2@example.com').update(
+            date_joined='2001-01-01T00:00:00Z')
+        call_command('export_users', output=path, until='2010-01-01')
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], ','.join(exports.COLUMNS))
+        self.assertEqual(len(lines), 2)
+        self.assertIn('export2@example.com', lines[1])
+
+    def test_admin_export_action(self):
+        User.objects.create_superuser(first_name='Admin', last_name='User',
+            email='admin@example.com', password='password')
+        self.client.login(email='admin@example.com', password='password')
+        response = self.client.post(
+            reverse('admin:accounts_user_changelist'), {
+                'action': 'export_as_csv',
+                '_selected_action': [self.user1.pk],
+            })
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(content.splitlines()), 2)
+        self.assertIn('testclient@example.com', content)
+
+
+class AssetBuildTests(TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source_dir)
+        os.makedirs(os.path.join(self.source_dir, 'css'))
+        for name, content in [
+                ('css/base.css', 'a {\n  color : red ;\n}\n'),
+                ('css/base.min.css', 'a{color:red}'),
+                ('css/site.css', '/* note */\n.icon { background: '
+                    'url("../img/x.png?v=1") ; content: "a  ;  b" }\n')]:
+            with open(os.path.join(self.source_dir, name), 'w') as f:
+                f.write(content)
+
+    def test_dedupe_keeps_last_and_prefers_minified(self):
+        self.assertEqual(assets.dedupe(
+            ['css/base.min.css', 'css/site.css', 'css/base.css'],
+            self.source_dir), ['css/site.css', 'css/base.min.css'])
+
+    def test_minify_css_preserves_strings(self):
+        self.assertEqual(assets.minify_css(
+            '/* c */ p ,  a > b {\n  content: " x ;  y " ;\n}\n'),
+            'p,a>b{content: " x ;  y "}')
+
+    def test_rebase_urls(self):
+        css = ('url(../fonts/a.eot?#iefix) url("img/b.png") '
+            'url(data:image/png;base64,AA==)')
+        self.assertEqual(assets.rebase_urls(css, 'css/site.css',
+            'bundles/site.css'), 'url(../fonts/a.eot?#iefix) '
+            'url("../css/img/b.png") url(data:image/png;base64,AA==)')
+
+    @override_settings(ASSET_MANIFEST='bundles/manifest.json')
+    def test_build_assets(self):
+        bundles = {'bundles/site.css': ['css/base.css', 'css/site.css']}
+        manifest = assets.build_assets(bundles, self.source_dir)
+        built = manifest['bundles/site.css']
+        self.assertRegex(built, r'^bundles/site\.[0-9a-f]{12}\.css$')
+        self.assertEqual(assets.load_manifest(self.source_dir), manifest)
+        path = os.path.join(self.source_dir, built)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'a{color:red}\n'
+                '.icon{background: url("../img/x.png?v=1");'
+                'content: "a  ;  b"}\n')
+        self.assertTrue(os.path.exists(path + '.gz'))
+
+        # Rebuilding changed content replaces the previous build
+        with open(os.path.join(self.source_dir, 'css/site.css'), 'a') as f:
+            f.write('p { margin: 0 }')
+        rebuilt = assets.build_assets(bundles, self.source_dir)
+        self.assertNotEqual(rebuilt['bundles/site.css'], built)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + '.gz'))
+
+    def test_layout_links_built_bundles(self):
+        manifest = assets.load_manifest()
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, '/static/{}'.format(
+            manifest['bundles/site.css']))
+        self.assertContains(response, '/static/{}'.format(
+            manifest['bundles/site.js']))
+        self.assertNotContains(response, 'bootstrap.min.css')
+
+
 ################################
 ########## Form Tests ##########
 ################################
@@ -236,6 +1940,32 @@ class UserUpdateFormTests(TestCase):
         self.assertFalse(form.is_valid())
 
 
+class UserProfileUpdateFormTests(TestCase):
+
+    def test_country_widget_matches_uncached_render(self):
+        from django_countries import countries
+        from django_countries.widgets import CountrySelectWidget
+        attrs = {'id': 'id_country'}
+        cached = CachedCountrySelectWidget()
+        for value in ['NZ', 'AF', '']:
+            self.assertHTMLEqual(
+                cached.render('country', value, dict(attrs)),
+                CountrySelectWidget(choices=countries).render(
+                    'country', value, dict(attrs)))
+        self.assertEqual(
+            cached.render('country', 'NZ').count('selected="selected"'), 1)
+
+    def test_country_choices_follow_language(self):
+        from django.utils import translation
+        form = UserProfileUpdateForm()
+        with translation.override('de'):
+            self.assertIn('Neuseeland', str(form['country']))
+        self.assertIn('New Zealand', str(form['country']))
+        form = UserProfileUpdateForm(data={'country': 'XX'})
+        form.is_valid()
+        self.assertIn('country', form.errors)
+
+
 class ValidatingPasswordChangeFormTests(TestDataMixin, TestCase):
 
     def setUp(self):
@@ -0,0 +1,135 @@
+"""Token bucket throttling of sign-in attempts.
+
+Each client IP address and each submitted email address gets a bucket held
+in a shared cache (LOGIN_THROTTLE_CACHE), so every worker process draws from
+the same tokens. Behind a reverse proxy listed in TRUSTED_PROXIES, the
+client IP is read from X-Forwarded-For.
+Attempts are checked before the form is validated, which means a throttled
+attempt never costs a password hash. Each bucket is updated under a short
+lock taken with cache.add(), so concurrent attempts cannot all spend the
+same token.
+"""
+import ipaddress
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+BUCKET_KEY = 'accounts:throttle:{}:{}'
+REJECTED_KEY = 'accounts:throttle:rejected:{}'
+SCOPES = ('ip', 'email')
+# How long a bucket's lock is held at most, and how often (and how far
+# apart) an attempt tries to take it before it is refused
+LOCK_TIMEOUT = 1
+LOCK_ATTEMPTS = 50
+LOCK_WAIT = 0.005
+
+
+def get_cache():
+    return caches[getattr(settings, 'LOGIN_THROTTLE_CACHE', 'default')]
+
+
+class TokenBucket(object):
+    """Allow `capacity` attempts at once, refilled at `capacity` tokens per
+    `period` seconds."""
+    def __init__(self, key, capacity, period, cache=None):
+        self.key = key
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.cache = cache or get_cache()
+
+    def consume(self):
+        """Take a token from the bucket. Returns False when it is empty,
+        or when the bucket stays locked by other attempts."""
+        lock = self.key + ':lock'
+        for attempt in range(LOCK_ATTEMPTS):
+            if self.cache.add(lock, 1, LOCK_TIMEOUT):
+                break
+            time.sleep(LOCK_WAIT)
+        else:
+            return False
+        try:
+            return self._consume()
+        finally:
+            self.cache.delete(lock)
+
+    def _consume(self):
+        now = time.time()
+        tokens, updated = self.cache.get(self.key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # Once the bucket would have refilled, a missing key means "full"
+        timeout = int(math.ceil((self.capacity - tokens) / self.rate)) + 1
+        self.cache.set(self.key, (tokens, now), timeout)
+        return allowed
+
+
+def get_client_ip(request):
+    """Return the address of the client, looking past trusted proxies."""
+    address = request.META.get('REMOTE_ADDR', '')
+    if not is_trusted_proxy(address):
+        return address
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    # Each proxy appends the address it got the request from, so the
+    # nearest untrusted one is the client; anything left of it is forgeable
+    for hop in reversed([hop.strip() for hop in forwarded.split(',')]):
+        if not hop:
+            break
+        address = hop
+        if not is_trusted_proxy(hop):
+            break
+    return address
+
+
+def is_trusted_proxy(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(proxy)
+        for proxy in getattr(settings, 'TRUSTED_PROXIES', ()))
+
+
+def throttle_sign_in(request, email):
+    """Record a sign-in attempt.
+
+    Returns the name of the scope ('ip' or 'email') whose bucket is empty,
+    or None when the attempt may go ahead.
+    """
+    rates = settings.LOGIN_THROTTLE_RATES
+    identities = {
+        'ip': get_client_ip(request),
+        'email': (email or '').strip().lower(),
+    }
+    for scope in SCOPES:
+        if scope not in rates or not identities[scope]:
+            continue
+        capacity, period = rates[scope]
+        bucket = TokenBucket(BUCKET_KEY.format(scope, identities[scope]),
+            capacity, period)
+        if not bucket.consume():
+            _record_rejection(scope)
+            return scope
+    return None
+
+
+def rejection_counts():
+    """Return the number of throttled attempts per scope."""
+    cache = get_cache()
+    counts = cache.get_many([REJECTED_KEY.format(scope) for scope in SCOPES])
+    return {scope: counts.get(REJECTED_KEY.format(scope), 0)
+            for scope in SCOPES}
+
+
+def _record_rejection(scope):
+    cache = get_cache()
+    key = REJECTED_KEY.format(scope)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, None)
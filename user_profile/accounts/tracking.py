@@ -0,0 +1,70 @@
+"""Change tracking for models saved from edit forms.
+
+ChangeTrackingMixin remembers the field values an instance was loaded
+with. Saving an existing instance then only writes the fields that have
+changed since (along with auto_now fields such as updated_at), and does
+nothing at all when none have. post_save receivers see the changed fields
+in `update_fields`, so they can skip work that depends on the others.
+"""
+from django.db.models.fields.files import FieldFile
+
+
+class ChangeTrackingMixin(object):
+
+    def __init__(self, *args, **kwargs):
+        super(ChangeTrackingMixin, self).__init__(*args, **kwargs)
+        self._snapshot()
+
+    def _tracked_value(self, field):
+        value = getattr(self, field.attname)
+        if isinstance(value, FieldFile):
+            # A file that has not been stored yet is always a change
+            return value.name if value._committed else object()
+        return value
+
+    def _snapshot(self, field_names=None):
+        """Record the current values as saved, of only `field_names` if
+        given."""
+        if field_names is None:
+            self._loaded_values = {}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (field_names is None or
+                    field.name in field_names or
+                    field.attname in field_names):
+                self._loaded_values[field.attname] = \
+                    self._tracked_value(field)
+
+    def get_changed_fields(self):
+        """Return the names of the fields changed since loading."""
+        changed = []
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if field.attname not in self._loaded_values or \
+                    self._tracked_value(field) != \
+                    self._loaded_values[field.attname]:
+                changed.append(field.name)
+        return changed
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and self.pk is not None and \
+                kwargs.get('update_fields') is None and not args and \
+                not kwargs.get('force_insert'):
+            changed = self.get_changed_fields()
+            if not changed:
+                return
+            kwargs['update_fields'] = changed + [
+                field.name for field in self._meta.concrete_fields
+                if getattr(field, 'auto_now', False) and
+                field.name not in changed]
+        super(ChangeTrackingMixin, self).save(*args, **kwargs)
+        # Fields left out of update_fields are still unsaved changes
+        update_fields = kwargs.get('update_fields',
+            args[3] if len(args) > 3 else None)
+        self._snapshot(None if update_fields is None else set(update_fields))
+    save.alters_data = True
+
+    def refresh_from_db(self, *args, **kwargs):
+        super(ChangeTrackingMixin, self).refresh_from_db(*args, **kwargs)
+        fields = kwargs.get('fields', args[1] if len(args) > 1 else None)
+        self._snapshot(None if fields is None else set(fields))
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    SkipFile, TemporaryFileUploadHandler
+)
+
+
+class BoundedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploads to a temporary file, never keeping more than
+    FILE_UPLOAD_MAX_SIZE bytes of one on disk.
+
+    A file that goes past the limit is skipped: its temporary file is
+    discarded and the rest of it is read without being kept. The skipped
+    field is recorded on the request (see too_large_uploads()) so forms can
+    report the size error instead of seeing no file at all.
+    """
+    def new_file(self, *args, **kwargs):
+        super(BoundedTemporaryFileUploadHandler, self).new_file(
+            *args, **kwargs)
+        self.max_size = settings.FILE_UPLOAD_MAX_SIZE
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            if self.request is not None:
+                self.request.too_large_uploads = \
+                    too_large_uploads(self.request) | {self.field_name}
+            raise SkipFile
+        self.file.write(raw_data)
+
+
+def too_large_uploads(request):
+    """Return the names of the file fields skipped for being too large."""
+    return getattr(request, 'too_large_uploads', frozenset())
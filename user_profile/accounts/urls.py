@@ -9,4 +9,6 @@ urlpatterns = [
     url(r'profile/$', views.user_profile, name='profile'),
     url(r'profile/edit/$', views.edit_user_profile, name='edit_profile'),
     url(r'profile/change_password/$', views.change_password, name='change_password'),
+    url(r'^profiles/$', views.profile_directory, name='directory'),
+    url(r'^api/profiles/$', views.profile_directory_api, name='directory_api'),
 ]
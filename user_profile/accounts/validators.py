@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.template.defaultfilters import filesizeformat
+
+from PIL import Image
+
+
+def avatar_too_large():
+    return ValidationError(
+        "Your photo must be smaller than %s." %
+        filesizeformat(settings.FILE_UPLOAD_MAX_SIZE)
+    )
+
+
+def validate_avatar(upload):
+    """Check an avatar upload's size, format and pixel dimensions.
+
+    Only the image header is parsed, so a small file that would decompress
+    into an enormous bitmap is rejected before any pixel data is decoded.
+    """
+    if upload.size > settings.FILE_UPLOAD_MAX_SIZE:
+        raise avatar_too_large()
+
+    try:
+        # Image.open() reads the header and leaves the pixel data alone
+        image = Image.open(upload)
+        image_format, (width, height) = image.format, image.size
+    except Exception:
+        raise ValidationError("Upload a valid image. The file you uploaded "
+            "was either not an image or a corrupted image.")
+    finally:
+        upload.seek(0)
+
+    if image_format not in settings.AVATAR_FORMATS:
+        raise ValidationError("Your photo must be one of these formats: "
+            "%s." % ', '.join(settings.AVATAR_FORMATS))
+
+    if width * height > settings.AVATAR_MAX_PIXELS:
+        raise ValidationError("Your photo is too large ({} x {} pixels). "
+            "Please upload a smaller image.".format(width, height))
@@ -1,41 +1,50 @@
+import hashlib
+from calendar import timegm
+
 from django.contrib import messages
-from django.contrib.auth import (
-    authenticate, login, logout, update_session_auth_hash
-)
+from django.contrib.auth import login, logout, update_session_auth_hash
 from django.contrib.auth.forms import AuthenticationForm
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.http import (
+    HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
+)
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
+from . import caching
+from . import directory
 from . import forms
 from . import models
+from . import outbox
+from . import sessions
+from . import throttling
+from . import uploadhandlers
 
 def sign_in(request):
     """User sign-in view."""
     form = AuthenticationForm()
     if request.method == 'POST':
+        email = request.POST.get('username', '')
+        if throttling.throttle_sign_in(request, email) is not None:
+            messages.error(
+                request,
+                "Too many sign-in attempts. Please wait a minute and try "
+                "again."
+            )
+            return render(request, 'accounts/sign_in.html',
+                {'form': AuthenticationForm(initial={'username': email})},
+                status=429)
         form = AuthenticationForm(data=request.POST)
+        # The form authenticates the user (and rejects disabled accounts)
+        # while validating, so there is no need to authenticate again.
         if form.is_valid():
-            user = authenticate(
-                email=request.POST['username'],
-                password=request.POST['password']
-            )
-            if user is not None:
-                if user.is_active:
-                    login(request, user)
-                    messages.success(request, "You've been logged in.")
-                    return HttpResponseRedirect(reverse('accounts:profile'))
-                else:
-                    messages.error(
-                        request,
-                        "That user account has been disabled."
-                    )
-            else:
-                messages.error(
-                    request,
-                    "Email or password is incorrect."
-                )
+            login(request, form.get_user())
+            messages.success(request, "You've been logged in.")
+            return HttpResponseRedirect(reverse('accounts:profile'))
     return render(request, 'accounts/sign_in.html', {'form': form})
 
 def sign_up(request):
@@ -44,14 +53,11 @@ def sign_up(request):
     if request.method == 'POST':
         form = forms.UserCreateForm(data=request.POST)
         if form.is_valid():
-            form.save()
-            user = authenticate(
-                first_name=form.cleaned_data['first_name'],
-                last_name=form.cleaned_data['last_name'],
-                email=form.cleaned_data['email'],
-                password=form.cleaned_data['password1']
-            )
+            # The new user is logged in directly; authenticating it would
+            # hash the password a second time.
+            user = form.save()
             login(request, user)
+            outbox.queue_email('welcome', user.email, {'user': user})
             messages.success(
                 request,
                 "You're now a user! You've been signed in, too."
@@ -66,11 +72,29 @@ def sign_out(request):
     messages.success(request, "You've been signed out. Come back soon!")
     return HttpResponseRedirect(reverse('home'))
 
+def _profile_etag(request):
+    # Pending messages are shown on the page, so it must be sent in full
+    if messages.get_messages(request):
+        return None
+    profile = request.user.userprofile
+    # The page changes with a deploy too, e.g. a new bundle or layout
+    return '{}-{:.6f}-{}'.format(request.user.pk,
+        profile.last_modified.timestamp(), caching.deploy_version()[0])
+
+def _profile_last_modified(request):
+    if messages.get_messages(request):
+        return None
+    return max(request.user.userprofile.last_modified,
+        caching.deploy_version()[1])
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_profile_etag, last_modified_func=_profile_last_modified)
 def user_profile(request):
     """Display user profile information."""
     user = request.user
-    return render(request, 'accounts/profile.html', {'user': user})
+    return render(request, 'accounts/profile.html',
+        {'user': user, 'profile_html': caching.render_profile(user)})
 
 @login_required
 def edit_user_profile(request):
@@ -83,11 +107,19 @@ def edit_user_profile(request):
         form2 = forms.UserProfileUpdateForm(
             instance=user.userprofile,
             data=request.POST,
-            files=request.FILES
+            files=request.FILES,
+            too_large_uploads=uploadhandlers.too_large_uploads(request)
         )
         if form1.is_valid() and form2.is_valid():
+            old_email = form1.initial['email']
             form1.save()
             form2.save()
+            if 'email' in form1.changed_data:
+                # Sent to the old address, in case it was not its owner
+                # who made the change
+                outbox.queue_email('email_changed', old_email,
+                    {'user': user, 'old_email': old_email},
+                    dedup=user.email)
             messages.success(request, "Your profile has been updated!")
             return HttpResponseRedirect(reverse('accounts:profile'))
     return render(request, 'accounts/edit_profile.html',
@@ -109,6 +141,60 @@ def change_password(request):
         if form.is_valid():
             form.save()
             update_session_auth_hash(request, form.user)
+            # Sign the user out on every other device
+            sessions.delete_user_sessions(form.user.pk,
+                keep=request.session.session_key)
+            outbox.queue_email('password_changed', form.user.email,
+                {'user': form.user})
             messages.success(request, "Your password has been updated!")
             return HttpResponseRedirect(reverse('accounts:profile'))
     return render(request, 'accounts/change_password.html', {'form': form})
+
+def _directory_page(request):
+    """Return (profiles, next page URL) for the directory request."""
+    try:
+        size = min(int(request.GET.get('limit', directory.PAGE_SIZE)),
+            directory.MAX_PAGE_SIZE)
+    except ValueError:
+        size = directory.PAGE_SIZE
+    profiles, cursor = directory.get_page(
+        country=request.GET.get('country'),
+        location=request.GET.get('location'),
+        cursor=request.GET.get('cursor'),
+        size=max(size, 1)
+    )
+    next_url = None
+    if cursor is not None:
+        params = request.GET.copy()
+        params['cursor'] = cursor
+        next_url = '{}?{}'.format(request.path, params.urlencode())
+    return profiles, next_url
+
+def profile_directory(request):
+    """Public directory of user profiles."""
+    try:
+        profiles, next_url = _directory_page(request)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor.")
+    return render(request, 'accounts/directory.html',
+        {'profiles': profiles, 'next_url': next_url})
+
+def profile_directory_api(request):
+    """JSON version of the profile directory."""
+    try:
+        profiles, next_url = _directory_page(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+    response = JsonResponse({
+        'results': [directory.profile_data(profile) for profile in profiles],
+        'next': next_url,
+    })
+    etag = hashlib.md5(response.content).hexdigest()
+    last_modified = None
+    if profiles:
+        last_modified = timegm(max(
+            profile.last_modified for profile in profiles).utctimetuple())
+        response['Last-Modified'] = http_date(last_modified)
+    response['ETag'] = quote_etag(etag)
+    return get_conditional_response(request, etag=etag,
+        last_modified=last_modified, response=response)
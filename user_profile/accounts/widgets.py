@@ -0,0 +1,49 @@
+"""Country select widget rendered from a per-language cache.
+
+Sorting the ~250 translated country names and rendering an <option> for
+each is done once per language and process. Each render then only marks
+the selected option.
+"""
+from django.utils.encoding import force_text
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from django_countries import countries
+from django_countries.widgets import CountrySelectWidget
+
+_choices = {}
+_options = {}
+
+
+def country_choices():
+    """Return the (code, name) country choices, sorted for the active
+    language."""
+    language = get_language()
+    choices = _choices.get(language)
+    if choices is None:
+        choices = _choices[language] = tuple(countries)
+    return choices
+
+
+class CachedCountrySelectWidget(CountrySelectWidget):
+    """CountrySelectWidget offering the countries of the active language.
+
+    The widget's own choices are ignored; use country_choices() for the
+    form field so validation sees the same list.
+    """
+
+    def render_options(self, selected_choices):
+        language = get_language()
+        options = _options.get(language)
+        if options is None:
+            options = _options[language] = '\n'.join(
+                self.render_option(set(), code, name)
+                for code, name in country_choices())
+        for value in selected_choices:
+            unselected = format_html('<option value="{}">', force_text(value))
+            if unselected in options:
+                return mark_safe(options.replace(unselected, format_html(
+                    '<option value="{}" selected="selected">',
+                    force_text(value)), 1))
+        return mark_safe(options)
@@ -0,0 +1,174 @@
+"""Write-behind buffering of frequently written user columns.
+
+Signing in used to save last_login straight away, one UPDATE per sign-in,
+all queueing for SQLite's write lock during a login storm. Instead,
+record() keeps the latest value per user in memory, and flush() writes
+everything pending in a single UPDATE ... SET col = CASE pk WHEN ... END.
+Each record() flushes when WRITE_BEHIND_BATCH_SIZE users are pending or
+the oldest pending value is WRITE_BEHIND_INTERVAL seconds old, and the
+process flushes when it exits. Once start_timer() has been called (the
+WSGI application does), a background timer also flushes each interval,
+so a process that sees no further sign-ins, or is killed, holds values
+for no longer than that.
+
+Values written again before a flush replace the pending one; those
+coalesced writes are counted in stats().
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Case, Value, When
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer(object):
+    """Pending column values for rows of one model, written in batches."""
+
+    def __init__(self, model, fields):
+        # An 'app_label.ModelName' label, resolved when flushing
+        self.model = model
+        self.fields = fields
+        self.pending = {}
+        self.oldest = None
+        # The database the pending values belong to
+        self.database = None
+        self.timed = False
+        self._timer = None
+        self.counts = {'recorded': 0, 'coalesced': 0, 'written': 0,
+            'flushes': 0}
+        self._lock = threading.Lock()
+
+    def record(self, pk, **values):
+        """Buffer new values for the row `pk`, flushing if due."""
+        with self._lock:
+            self.counts['recorded'] += 1
+            if pk in self.pending:
+                self.counts['coalesced'] += 1
+                self.pending[pk].update(values)
+            else:
+                self.pending[pk] = values
+            if self.oldest is None:
+                self.oldest = time.time()
+                self.database = self._database()
+            due = self._due()
+            self._arm()
+        if due:
+            try:
+                self.flush()
+            except Exception:
+                # Logged by flush(), which kept the values for the next one;
+                # the caller (a sign-in) must not fail because of it
+                pass
+
+    def start_timer(self):
+        """Also flush WRITE_BEHIND_INTERVAL seconds after values start
+        waiting, from a background thread.
+
+        The thread is started by the first record(), so it is started in
+        each worker forked after this call.
+        """
+        with self._lock:
+            self.timed = True
+            if self.pending:
+                self._arm()
+
+    def _arm(self):
+        # Called with the lock held
+        if not self.timed or self._timer is not None:
+            return
+        self._timer = threading.Timer(
+            getattr(settings, 'WRITE_BEHIND_INTERVAL', 10),
+            self._flush_on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            # Logged by flush(), which kept the values for the next one
+            pass
+        finally:
+            connections.close_all()
+        with self._lock:
+            if self.pending:
+                self._arm()
+
+    def _database(self):
+        return connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+
+    def _due(self):
+        batch_size = getattr(settings, 'WRITE_BEHIND_BATCH_SIZE', 100)
+        interval = getattr(settings, 'WRITE_BEHIND_INTERVAL', 10)
+        return len(self.pending) >= batch_size or \
+            time.time() - self.oldest >= interval
+
+    def flush(self):
+        """Write every pending value; returns the number of rows updated."""
+        with self._lock:
+            pending, self.pending, self.oldest = self.pending, {}, None
+            database, self.database = self.database, None
+        if not pending:
+            return 0
+        if database != self._database():
+            # e.g. values recorded in a test database that has since been
+            # torn down; they must not land in another database
+            logger.warning("Dropped %d pending %s row(s) recorded in "
+                "another database", len(pending), self.model)
+            return 0
+        model = apps.get_model(self.model)
+        updates = {}
+        for name in self.fields:
+            whens = [When(pk=pk, then=Value(values[name]))
+                for pk, values in pending.items() if name in values]
+            if whens:
+                updates[name] = Case(*whens, default=name,
+                    output_field=model._meta.get_field(name))
+        try:
+            rows = model._default_manager.filter(
+                pk__in=list(pending)).update(**updates)
+        except Exception:
+            logger.exception("Could not write %d pending %s row(s)",
+                len(pending), self.model)
+            self._restore(pending, database)
+            raise
+        with self._lock:
+            self.counts['written'] += rows
+            self.counts['flushes'] += 1
+        return rows
+
+    def _restore(self, pending, database):
+        # Values recorded since the flush started are newer; keep those
+        with self._lock:
+            for pk, values in pending.items():
+                self.pending[pk] = dict(values, **self.pending.get(pk, {}))
+            if self.oldest is None:
+                self.oldest = time.time()
+                self.database = database
+
+    def stats(self):
+        """Return the counters of this process, and the rows pending."""
+        with self._lock:
+            return dict(self.counts, pending=len(self.pending))
+
+
+last_logins = WriteBehindBuffer(settings.AUTH_USER_MODEL,
+    ['last_login'])
+
+
+def flush_at_exit():
+    try:
+        last_logins.flush()
+    except Exception:
+        # Already logged; nothing else can be done this late
+        pass
+
+atexit.register(flush_at_exit)
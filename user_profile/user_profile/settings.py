@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'accounts.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,13 +52,34 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'accounts.middleware.PasswordHasherStatsMiddleware',
 ]
 
+# RequestMetricsMiddleware limits per URL name. Keys are any of queries,
+# db_ms, template_ms, hashing_ms and total_ms. Going over a limit is logged,
+# or raises BudgetExceeded when REQUEST_BUDGET_ACTION is 'raise'.
+REQUEST_BUDGETS = {
+    'home': {'queries': 2},
+    # Sign-ins may also write the batch of pending last_login values
+    'accounts:sign_in': {'queries': 9},
+    'accounts:sign_up': {'queries': 18},
+    'accounts:profile': {'queries': 4},
+    # Changing the email, location and avatar at once
+    'accounts:edit_profile': {'queries': 17},
+    # With the user signed in elsewhere, whose sessions are then deleted
+    'accounts:change_password': {'queries': 13},
+    'accounts:directory': {'queries': 1},
+    'accounts:directory_api': {'queries': 1},
+}
+REQUEST_BUDGET_ACTION = 'log'
+
 ROOT_URLCONF = 'user_profile.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for RequestMetricsMiddleware
+        'BACKEND': 'accounts.templating.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -72,6 +94,19 @@ TEMPLATES = [
     },
 ]
 
+# Outside DEBUG, templates are compiled once and kept by the cached loader.
+# user_profile.wsgi compiles the project's templates, and those of
+# TEMPLATE_WARMUP_APPS, when the process starts.
+if not DEBUG:
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+TEMPLATE_WARMUP_APPS = ['bootstrap3']
+
 WSGI_APPLICATION = 'user_profile.wsgi.application'
 
 
@@ -86,6 +121,60 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Sessions must be cached where every process sees them, or a session
+    # deleted by one process stays valid in the others. Files are shared by
+    # all processes on this host; use memcached when serving from several.
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'sessions'),
+    },
+    # Likewise for users: a user saved (e.g. deactivated) by one process
+    # must be dropped from the cache of every other process
+    'users': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'users'),
+    },
+    # Sign-in throttling buckets, drawn from by every process. Their locks
+    # need an atomic add(), as memcached's is.
+    'throttle': {
+        'BACKEND': 'accounts.filecache.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'throttle'),
+    },
+}
+
+# Rendered profile fragments, keyed by when their user or profile last changed
+PROFILE_CACHE_ALIAS = 'default'
+PROFILE_CACHE_TIMEOUT = 60 * 60
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/1.10/topics/auth/passwords/
+
+# Same algorithm as Django's default PBKDF2 hasher, counting every hash
+PASSWORD_HASHERS = [
+    'accounts.hashers.InstrumentedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.BCryptPasswordHasher',
+]
+
+
+# Sessions are read from the cache and written through to the database,
+# indexed by user. One batch of expired sessions is removed every
+# SESSION_CLEANUP_INTERVAL seconds.
+SESSION_ENGINE = 'accounts.sessions'
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_CLEANUP_INTERVAL = 60
+SESSION_CLEANUP_BATCH_SIZE = 500
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -97,7 +186,9 @@ AUTH_PASSWORD_VALIDATORS = [
         'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
     },
     {
-        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+        # Looks passwords up in a memory-mapped sorted list shared by all
+        # worker processes; rebuild it with `manage.py build_password_list`
+        'NAME': 'accounts.passwords.MappedCommonPasswordValidator',
     },
     {
         'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
@@ -126,17 +217,92 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'assets'),
 ]
+# Resolves bundle names to the hashed files built by build_assets
+STATICFILES_STORAGE = 'accounts.storage.BundleStaticFilesStorage'
+
+# Bundles built by `manage.py build_assets`, as listed by layout.html before
+# bundling. Repeated files (including x.css next to x.min.css) are dropped.
+ASSET_SOURCE_DIR = os.path.join(BASE_DIR, 'assets')
+ASSET_MANIFEST = 'bundles/manifest.json'
+ASSET_BUNDLES = {
+    'bundles/site.css': [
+        'css/bootstrap.min.css',
+        'css/bootstrap-theme.css',
+        'css/bootstrap.css',
+        'css/global.css',
+    ],
+    'bundles/site.js': [
+        'js/autogrow.js',
+        'js/global.js',
+        'js/bootstrap.js',
+        'js/bootstrap.min.js',
+    ],
+}
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'assets', 'media')
 MEDIA_URL = '/media/'
 
+# user_profile.wsgi serves STATIC_URL and MEDIA_URL itself. Hashed bundle
+# names are cached for a year; other files for this many seconds.
+STATIC_SERVER_MAX_AGE = 60
+
+# Uploads are streamed to temporary files, keeping at most
+# FILE_UPLOAD_MAX_SIZE bytes of each
+FILE_UPLOAD_HANDLERS = [
+    'accounts.uploadhandlers.BoundedTemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+
+# Avatar uploads are checked from the image header only
+AVATAR_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+AVATAR_MAX_PIXELS = 40 * 1000 * 1000
+
+# Background jobs (accounts.tasks) are run by `manage.py run_workers`.
+# TASKS_EAGER runs them inside the request instead. Jobs still marked as
+# running after TASK_LOCK_TIMEOUT seconds are handed to another worker.
+TASKS_EAGER = False
+TASK_LOCK_TIMEOUT = 600
+
+# Account emails are queued in the outbox and sent in batches of
+# OUTBOX_BATCH_SIZE over one SMTP connection. Each recipient gets at most
+# OUTBOX_RECIPIENT_RATE[0] emails per OUTBOX_RECIPIENT_RATE[1] seconds.
+DEFAULT_FROM_EMAIL = 'Circle <no-reply@circle.example.com>'
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_RECIPIENT_RATE = (5, 3600)
+OUTBOX_MAX_ATTEMPTS = 3
+
+# last_login updates are buffered in memory and written in one UPDATE once
+# WRITE_BEHIND_BATCH_SIZE users are pending or the oldest has waited
+# WRITE_BEHIND_INTERVAL seconds (checked by a timer under the WSGI
+# application), and when the process exits
+WRITE_BEHIND_BATCH_SIZE = 100
+WRITE_BEHIND_INTERVAL = 10
+
 ## Custom auth settings
 # Custom User model
 AUTH_USER_MODEL = 'accounts.User'
 
+# Users are loaded for each request through this cache, together with their
+# profile, for up to USER_CACHE_TIMEOUT seconds or until they are saved
+AUTHENTICATION_BACKENDS = ['accounts.backends.CachedModelBackend']
+USER_CACHE_ALIAS = 'users'
+USER_CACHE_TIMEOUT = 5 * 60
+
 LOGIN_URL = '/accounts/sign_in/'
 LOGIN_REDIRECT_URL = '/accounts/profile/'
 
+# Sign-in throttling: (burst, seconds to refill it) per client IP and per
+# email address, with bucket state kept in this cache
+LOGIN_THROTTLE_RATES = {
+    'ip': (30, 60),
+    'email': (5, 60),
+}
+LOGIN_THROTTLE_CACHE = 'throttle'
+
+# Addresses (or networks) of the reverse proxies in front of the site. The
+# client IP of a request from one of them is taken from X-Forwarded-For.
+TRUSTED_PROXIES = ['127.0.0.1', '::1']
+
 ## Testing
 # # Use nose to run all tests
 # TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
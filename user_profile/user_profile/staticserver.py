@@ -0,0 +1,304 @@
+"""WSGI middleware serving static assets and media without Django's views.
+
+Files under each mounted directory are indexed once at startup, together
+with any precompressed .br and .gz siblings written by build_assets. A
+request matching the index is answered before it reaches Django:
+
+- the best encoding the client accepts is picked from Accept-Encoding
+- whole files are sent through the server's wsgi.file_wrapper, which lets
+  servers such as gunicorn use sendfile()
+- single byte ranges are answered with 206 Partial Content
+- ETag and Last-Modified validators give 304 Not Modified responses; each
+  encoding has its own ETag, as caches must not swap one for another
+- hashed names such as site.0123456789ab.css are cached for a year and
+  marked immutable
+
+Media files uploaded after startup are found with a stat() and added to
+the index; indexed media files are re-checked so replaced uploads are
+never served stale.
+"""
+import logging
+import mimetypes
+import os
+import re
+import time
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.utils.http import http_date, parse_http_date_safe
+
+logger = logging.getLogger(__name__)
+
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Content codings in order of preference, with their file suffixes
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+CHUNK_SIZE = 64 * 1024
+
+STATUSES = {
+    200: '200 OK',
+    206: '206 Partial Content',
+    304: '304 Not Modified',
+    416: '416 Range Not Satisfiable',
+}
+
+
+class StaticFile(object):
+    """One indexed file and its precompressed variants."""
+
+    def __init__(self, path, stat, url):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.etag = '"{:x}-{:x}"'.format(self.mtime, self.size)
+        self.last_modified = http_date(self.mtime)
+        content_type, _ = mimetypes.guess_type(path)
+        self.content_type = content_type or 'application/octet-stream'
+        self.immutable = bool(HASHED_NAME.search(url))
+        # Content encoding -> (path, size)
+        self.variants = {}
+        for encoding, suffix in ENCODINGS:
+            try:
+                variant_stat = os.stat(path + suffix)
+            except OSError:
+                continue
+            self.variants[encoding] = (path + suffix, variant_stat.st_size)
+
+    def etag_for(self, encoding):
+        """Return the strong ETag of the file sent with `encoding`."""
+        if encoding is None:
+            return self.etag
+        return '{}-{}"'.format(self.etag[:-1], encoding)
+
+    def changed(self, stat):
+        return (stat.st_size, int(stat.st_mtime)) != (self.size, self.mtime)
+
+
+class Mount(object):
+    """A URL prefix served from a directory."""
+
+    def __init__(self, prefix, root, dynamic=False, exclude=()):
+        self.prefix = prefix
+        self.root = os.path.abspath(root)
+        self.dynamic = dynamic
+        self.exclude = [os.path.abspath(path) for path in exclude]
+
+    def walk(self):
+        """Yield (url, path) for every file under the mount's root."""
+        for directory, dirs, files in os.walk(self.root):
+            dirs[:] = [name for name in dirs
+                if os.path.join(directory, name) not in self.exclude]
+            for name in files:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.root)
+                yield self.prefix + relative.replace(os.sep, '/'), path
+
+    def resolve(self, url):
+        """Return the filesystem path for a URL below the prefix, or None."""
+        relative = url[len(self.prefix):]
+        parts = relative.split('/')
+        if not relative or '..' in parts or '' in parts or '\x00' in relative:
+            return None
+        path = os.path.join(self.root, *parts)
+        if any(path == root or path.startswith(root + os.sep)
+                for root in self.exclude):
+            return None
+        return path
+
+
+class StaticFilesApplication(object):
+    """Wrap a WSGI application, answering requests for indexed files."""
+
+    def __init__(self, application, mounts=None, max_age=None):
+        self.application = application
+        self.mounts = mounts if mounts is not None else default_mounts()
+        self.max_age = max_age if max_age is not None else getattr(
+            settings, 'STATIC_SERVER_MAX_AGE', 60)
+        self.files = {}
+        started = time.time()
+        for mount in self.mounts:
+            for url, path in mount.walk():
+                self._add(url, path)
+        logger.info("Indexed %d static and media files in %.3fs",
+            len(self.files), time.time() - started)
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self.application(environ, start_response)
+        static_file = self.find(environ.get('PATH_INFO', ''))
+        if static_file is None:
+            return self.application(environ, start_response)
+        return self.serve(static_file, environ, start_response)
+
+    def _add(self, url, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        self.files[url] = StaticFile(path, stat, url)
+        return self.files[url]
+
+    def find(self, url):
+        """Return the StaticFile for a URL, or None to pass it to Django."""
+        mount = next((mount for mount in self.mounts
+            if url.startswith(mount.prefix)), None)
+        if mount is None:
+            return None
+        static_file = self.files.get(url)
+        if not mount.dynamic:
+            return static_file
+        path = mount.resolve(url)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.files.pop(url, None)
+            return None
+        if not os.path.isfile(path):
+            return None
+        if static_file is None or static_file.changed(stat):
+            static_file = self._add(url, path)
+        return static_file
+
+    def serve(self, static_file, environ, start_response):
+        byte_range = None
+        if 'HTTP_RANGE' in environ and if_range_matches(static_file, environ):
+            byte_range = parse_range(environ['HTTP_RANGE'], static_file.size)
+        if byte_range is None:
+            encoding = choose_encoding(static_file.variants,
+                environ.get('HTTP_ACCEPT_ENCODING', ''))
+        else:
+            # Ranges always refer to the identity encoding
+            encoding = None
+        etag = static_file.etag_for(encoding)
+        headers = [
+            ('Content-Type', static_file.content_type),
+            ('Last-Modified', static_file.last_modified),
+            ('ETag', etag),
+            ('Accept-Ranges', 'bytes'),
+            ('Cache-Control', IMMUTABLE if static_file.immutable else
+                'public, max-age={}'.format(self.max_age)),
+        ]
+        if static_file.variants:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if not_modified(static_file, etag, environ):
+            start_response(STATUSES[304], headers)
+            return []
+
+        if byte_range == ():
+            headers.append(('Content-Range',
+                'bytes */{}'.format(static_file.size)))
+            start_response(STATUSES[416], headers)
+            return []
+
+        path, size = static_file.path, static_file.size
+        if byte_range is not None:
+            start, end = byte_range
+            headers.append(('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, size)))
+            headers.append(('Content-Length', str(end - start + 1)))
+            start_response(STATUSES[206], headers)
+            if environ['REQUEST_METHOD'] == 'HEAD':
+                return []
+            return read_range(path, start, end - start + 1)
+
+        if encoding is not None:
+            path, size = static_file.variants[encoding]
+            headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Length', str(size)))
+        start_response(STATUSES[200], headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return file_wrapper(open(path, 'rb'), CHUNK_SIZE)
+
+
+def default_mounts():
+    """Mount STATIC_URL and MEDIA_URL on their directories."""
+    static_root = settings.STATIC_ROOT or settings.STATICFILES_DIRS[0]
+    mounts = [Mount(settings.STATIC_URL, static_root,
+        exclude=[settings.MEDIA_ROOT])]
+    if settings.MEDIA_URL and settings.MEDIA_ROOT:
+        mounts.append(Mount(settings.MEDIA_URL, settings.MEDIA_ROOT,
+            dynamic=True))
+    return mounts
+
+
+def choose_encoding(variants, accept_encoding):
+    """Return the preferred encoding of `variants` the client accepts."""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding, _ in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get('*', 0))
+        if encoding in variants and quality > 0:
+            return encoding
+    return None
+
+
+def not_modified(static_file, etag, environ):
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = [value.strip().replace('W/', '', 1)
+            for value in if_none_match.split(',')]
+        return '*' in etags or etag in etags
+    if_modified_since = parse_http_date_safe(
+        environ.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and \
+        static_file.mtime <= if_modified_since
+
+
+def if_range_matches(static_file, environ):
+    if_range = environ.get('HTTP_IF_RANGE')
+    if if_range is None:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == static_file.etag
+    return if_range == static_file.last_modified
+
+
+def parse_range(header, size):
+    """Return (start, end) for a single satisfiable byte range.
+
+    Returns None to ignore the header, as for multiple ranges, and () when
+    the range cannot be satisfied.
+    """
+    match = RANGE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # A suffix range: the last `end` bytes
+        length = int(end)
+        if length == 0:
+            return ()
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        return ()
+    return start, end
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
@@ -0,0 +1,64 @@
+"""Startup compilation of templates into the cached template loader.
+
+Outside DEBUG, settings.py puts every Django template engine behind
+django.template.loaders.cached.Loader, which compiles a template the first
+time it is requested and keeps it for the life of the process.
+warm_template_cache() requests all of the project's templates, plus those
+of the apps in TEMPLATE_WARMUP_APPS, up front, so the first requests after
+a deploy do not pay for reading and parsing them.
+"""
+import logging
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.template import TemplateSyntaxError, engines
+from django.template.backends.django import DjangoTemplates
+from django.template.loaders.cached import Loader as CachedLoader
+
+logger = logging.getLogger(__name__)
+
+
+def template_names(engine):
+    """Yield the names of the templates to compile for a Django engine."""
+    directories = list(engine.engine.dirs)
+    for label in getattr(settings, 'TEMPLATE_WARMUP_APPS', ['bootstrap3']):
+        directories.append(os.path.join(
+            apps.get_app_config(label).path, 'templates'))
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            for name in sorted(files):
+                if name.endswith(('.html', '.txt')):
+                    path = os.path.relpath(os.path.join(root, name),
+                        directory)
+                    yield path.replace(os.sep, '/')
+
+
+def is_cached(engine):
+    return any(isinstance(loader, CachedLoader)
+        for loader in engine.engine.template_loaders)
+
+
+def warm_template_cache():
+    """Compile templates into each engine's cached loader.
+
+    Returns the number of templates compiled and the seconds it took.
+    Engines without a cached loader are skipped, since templates compiled
+    for them would be thrown away.
+    """
+    started = time.time()
+    count = 0
+    for engine in engines.all():
+        if not isinstance(engine, DjangoTemplates) or not is_cached(engine):
+            continue
+        for name in template_names(engine):
+            try:
+                engine.get_template(name)
+            except TemplateSyntaxError:
+                logger.exception("Could not compile template %s", name)
+            else:
+                count += 1
+    elapsed = time.time() - started
+    logger.info("Compiled %d templates in %.3fs", count, elapsed)
+    return count, elapsed
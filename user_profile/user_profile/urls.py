@@ -30,5 +30,5 @@ urlpatterns = [
 urlpatterns += staticfiles_urlpatterns()
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL,
+    urlpatterns += static(settings.MEDIA_URL, views.serve_media,
         document_root=settings.MEDIA_ROOT)
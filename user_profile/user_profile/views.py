@@ -1,6 +1,11 @@
+import os
+
 from django.shortcuts import render
 from django.http import HttpResponseRedirect
 from django.core.urlresolvers import reverse
+from django.utils._os import safe_join
+from django.views.decorators.http import condition
+from django.views.static import serve
 
 
 def home(request):
@@ -8,3 +13,18 @@ def home(request):
     if request.user.is_authenticated():
         return HttpResponseRedirect(reverse('accounts:profile'))
     return render(request, 'home.html')
+
+
+def _media_etag(request, path, document_root=None, show_indexes=False):
+    try:
+        stat = os.stat(safe_join(document_root, path))
+    except (OSError, ValueError):
+        return None
+    return '{:x}-{:x}'.format(int(stat.st_mtime), stat.st_size)
+
+
+@condition(etag_func=_media_etag)
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """Development media view answering If-None-Match as well as
+    If-Modified-Since, so avatars are revalidated with 304 responses."""
+    return serve(request, path, document_root, show_indexes)
@@ -14,3 +14,18 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "user_profile.settings")
 
 application = get_wsgi_application()
+
+# Write buffered last_login values on time, even once sign-ins stop
+from accounts.writebehind import last_logins  # noqa: E402
+
+last_logins.start_timer()
+
+# Compile templates now rather than on the first requests
+from .templatecache import warm_template_cache  # noqa: E402
+
+warm_template_cache()
+
+# Static assets and media are answered here, before Django's URL routing.
+from .staticserver import StaticFilesApplication  # noqa: E402
+
+application = StaticFilesApplication(application)